@@ -1,70 +1,73 @@
 from llama_parse import LlamaParse
+from blake3 import blake3
 from llama_index.core.schema import Document
+from llama_index.core.async_utils import asyncio_run
 from pathlib import Path
 from typing import List, Optional, Dict, Any
 import logging
 import os
+import sys
 import hashlib
+import asyncio
+import re
 from datetime import datetime
-from config.settings import LLAMAPARSE_API_KEY
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import LLAMAPARSE_API_KEY, PDF_PARSER
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Read size used when hashing files
+HASH_CHUNK_SIZE = 1 << 20  # 1 MiB
 
-def parse_pdf(file_path: str, api_key: Optional[str] = None) -> List[Document]:
+# File hash length in bytes (hex digests are twice as long)
+HASH_DIGEST_SIZE = 16
+
+# Upper bound on concurrent file hashing threads in batch mode
+MAX_HASH_WORKERS = 8
+
+# Arabic Unicode block, used for basic language detection
+_ARABIC_RE = re.compile(r'[\u0600-\u06FF]')
+
+# Characters sampled from each end of a text for language detection
+LANGUAGE_SAMPLE_SIZE = 4096
+
+# Upper bound on in-flight LlamaParse jobs in batch mode
+MAX_PARSE_WORKERS = 8
+
+# Parse locally with PyMuPDF instead of the LlamaParse API (optional dependency)
+USE_PYMUPDF = PDF_PARSER == "pymupdf"
+
+
+def parse_pdf(file_path: str,
+              api_key: Optional[str] = None,
+              file_hash: Optional[str] = None,
+              file_size: Optional[int] = None,
+              batch_id: Optional[str] = None) -> List[Document]:
     """
     Parse PDF documents with enhanced support for Arabic text and tables.
     
     Args:
         file_path (str): Path to the PDF file
         api_key (Optional[str]): LlamaParse API key (optional for local parsing)
+        file_hash (Optional[str]): Precomputed file hash, skips re-hashing the file
+        file_size (Optional[int]): Precomputed file size in bytes, skips a stat call
+        batch_id (Optional[str]): Batch identifier to stamp on every page
     
     Returns:
         List[Document]: Parsed documents with metadata
     """
     try:
-        # Use provided API key or fall back to environment variable
-        if api_key is None:
-            api_key = LLAMAPARSE_API_KEY
-        
-        if not api_key:
-            raise ValueError("LlamaParse API key is required. Please set LLAMAPARSE_API_KEY environment variable.")
-        
-        # Initialize LlamaParse with enhanced settings for Arabic and tables
-        parser = LlamaParse(
-            api_key=api_key,
-            result_type="markdown",  # Changed from "all" to "markdown"
-            verbose=True,
-             invalidate_cache=True,
-            # Enhanced settings for better Arabic and table support
-            parsing_instruction="Extract all text including Arabic content and preserve table structures. Maintain original formatting where possible."
-        )
-        
         # Parse the document
-        documents = parser.load_data(Path(file_path))
-        
-        # Add metadata to each document
-        file_name = Path(file_path).name
-        file_size = os.path.getsize(file_path)
-        file_hash = get_file_hash(file_path)
-        
-        for i, doc in enumerate(documents):
-            doc.metadata.update({
-                "file_name": file_name,
-                "page": i + 1,
-                "file_path": str(file_path),
-                "file_size": file_size,
-                "file_hash": file_hash,
-                "parsing_method": "llamaparse",
-                "parsing_timestamp": datetime.now().isoformat()
-            })
-            
-            # Log parsing progress
-            logger.info(f"Parsed page {i + 1} from {file_name}")
+        if USE_PYMUPDF:
+            documents = _load_with_pymupdf(file_path)
+        else:
+            parser = _create_parser(_resolve_api_key(api_key))
+            documents = parser.load_data(Path(file_path))
         
-        logger.info(f"Successfully parsed {len(documents)} pages from {file_name}")
+        _attach_metadata(documents, file_path, file_hash, file_size, batch_id)
         return documents
         
     except Exception as e:
@@ -72,6 +75,154 @@ def parse_pdf(file_path: str, api_key: Optional[str] = None) -> List[Document]:
         raise Exception(f"Failed to parse PDF: {str(e)}")
 
 
+def parse_pdfs_batch(file_paths: List[str],
+                     api_key: Optional[str] = None,
+                     file_hashes: Optional[Dict[str, str]] = None,
+                     file_sizes: Optional[Dict[str, int]] = None,
+                     batch_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Parse several PDF files through a single LlamaParse client in one submission.
+    
+    Args:
+        file_paths (List[str]): List of PDF file paths
+        api_key (Optional[str]): LlamaParse API key
+        file_hashes (Optional[Dict[str, str]]): Precomputed hashes keyed by file path
+        file_sizes (Optional[Dict[str, int]]): Precomputed sizes in bytes keyed by file path
+        batch_id (Optional[str]): Batch identifier to stamp on every page
+    
+    Returns:
+        Dict[str, Any]: Parsed documents keyed by file path, and per-file errors
+    """
+    file_hashes = file_hashes or {}
+    file_sizes = file_sizes or {}
+    results = {
+        'documents': {},
+        'errors': []
+    }
+    
+    if not file_paths:
+        return results
+    
+    if USE_PYMUPDF:
+        # PyMuPDF is not thread-safe and holds the GIL while parsing, so files are parsed serially
+        outcomes = []
+        for file_path in file_paths:
+            try:
+                outcomes.append(_load_with_pymupdf(file_path))
+            except Exception as e:
+                outcomes.append(e)
+    else:
+        parser = _create_parser(_resolve_api_key(api_key))
+        
+        async def _load_all():
+            # Bound in-flight jobs so large batches don't flood the LlamaParse queue
+            semaphore = asyncio.Semaphore(MAX_PARSE_WORKERS)
+            
+            async def _load_one(file_path: str) -> List[Document]:
+                async with semaphore:
+                    return await parser.aload_data(Path(file_path))
+            
+            return await asyncio.gather(*(_load_one(path) for path in file_paths), return_exceptions=True)
+        
+        # Submit each file as its own job so returned documents map back to their source path;
+        # asyncio_run falls back to a worker thread when called inside a running event loop
+        outcomes = asyncio_run(_load_all())
+    
+    for file_path, outcome in zip(file_paths, outcomes):
+        try:
+            if isinstance(outcome, Exception):
+                raise outcome
+            
+            _attach_metadata(outcome, file_path, file_hashes.get(file_path), file_sizes.get(file_path), batch_id)
+            results['documents'][file_path] = outcome
+            
+        except Exception as e:
+            logger.error(f"Error parsing PDF {file_path}: {str(e)}")
+            results['errors'].append({
+                'file_path': file_path,
+                'error': f"Failed to parse PDF: {str(e)}"
+            })
+    
+    return results
+
+
+def _resolve_api_key(api_key: Optional[str] = None) -> str:
+    """Return the provided API key or fall back to the environment variable."""
+    if api_key is None:
+        api_key = LLAMAPARSE_API_KEY
+    
+    if not api_key:
+        raise ValueError("LlamaParse API key is required. Please set LLAMAPARSE_API_KEY environment variable.")
+    
+    return api_key
+
+
+def _create_parser(api_key: str) -> LlamaParse:
+    """
+    Create a LlamaParse client configured for Arabic text and tables.
+    
+    Build one per call or batch, never share it: the client's async connection pool is
+    bound to the event loop that first used it, and every sync load_data call runs its
+    own loop.
+    """
+    # Initialize LlamaParse with enhanced settings for Arabic and tables
+    return LlamaParse(
+        api_key=api_key,
+        result_type="markdown",  # Changed from "all" to "markdown"
+        verbose=True,
+        invalidate_cache=True,
+        # Enhanced settings for better Arabic and table support
+        parsing_instruction="Extract all text including Arabic content and preserve table structures. Maintain original formatting where possible."
+    )
+
+
+def _load_with_pymupdf(file_path: str) -> List[Document]:
+    """Extract plain text page by page with PyMuPDF, imported on first use."""
+    try:
+        import fitz  # PyMuPDF
+    except ImportError as e:
+        raise ImportError("PDF_PARSER=pymupdf requires PyMuPDF. Install it with: pip install pymupdf") from e
+    
+    with fitz.open(file_path) as pdf:
+        return [Document(text=page.get_text("text")) for page in pdf]
+
+
+def _attach_metadata(documents: List[Document],
+                     file_path: str,
+                     file_hash: Optional[str] = None,
+                     file_size: Optional[int] = None,
+                     batch_id: Optional[str] = None) -> None:
+    """Add file and page metadata to each parsed document."""
+    file_name = Path(file_path).name
+    if file_size is None:
+        file_size = os.path.getsize(file_path)
+    if file_hash is None:
+        file_hash = get_file_hash(file_path)
+    
+    # Metadata shared by every page, built once per file with a single timestamp
+    common_metadata = {
+        "file_name": file_name,
+        "file_path": str(file_path),
+        "file_size": file_size,
+        "file_hash": file_hash,
+        "parsing_method": "pymupdf" if USE_PYMUPDF else "llamaparse",
+        "parsing_timestamp": datetime.now().isoformat()
+    }
+    if batch_id is not None:
+        common_metadata["batch_id"] = batch_id
+    
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
+    for i, doc in enumerate(documents):
+        doc.metadata.update(common_metadata)
+        doc.metadata["page"] = i + 1
+        
+        # Log parsing progress (debug only, so no message is built per page otherwise)
+        if debug_enabled:
+            logger.debug("Parsed page %d from %s", i + 1, file_name)
+    
+    logger.info(f"Successfully parsed {len(documents)} pages from {file_name}")
+
+
 def parse_multiple_pdfs(file_paths: List[str], api_key: Optional[str] = None) -> Dict[str, Any]:
     """
     Parse multiple PDF files and return comprehensive results.
@@ -97,22 +248,21 @@ def parse_multiple_pdfs(file_paths: List[str], api_key: Optional[str] = None) ->
     }
     
     start_time = datetime.now()
+    # Raw digests take far less memory than their hex strings
     processed_hashes = set()
     
+    # Validate up front so only valid files are hashed
+    valid_files = []
     for file_path in file_paths:
         try:
-            # Check for duplicates
-            file_hash = get_file_hash(file_path)
-            if file_hash in processed_hashes:
-                results['errors'].append({
-                    'file_path': file_path,
-                    'error': 'Duplicate file detected'
-                })
-                results['stats']['failed_files'] += 1
-                continue
+            # Stat once and reuse the size for validation, parsing and stats
+            try:
+                file_size = os.stat(file_path).st_size
+            except OSError:
+                file_size = None
             
-            # Validate PDF
-            if not validate_pdf(file_path):
+            # Validate PDF before hashing so invalid files never pay for a full read
+            if not validate_pdf(file_path, size=file_size):
                 results['errors'].append({
                     'file_path': file_path,
                     'error': 'Invalid PDF file'
@@ -120,23 +270,7 @@ def parse_multiple_pdfs(file_paths: List[str], api_key: Optional[str] = None) ->
                 results['stats']['failed_files'] += 1
                 continue
             
-            # Parse PDF
-            docs = parse_pdf(file_path, api_key)
-            
-            # Add batch metadata
-            for doc in docs:
-                doc.metadata.update({
-                    'batch_id': start_time.isoformat(),
-                    'file_hash': file_hash
-                })
-            
-            results['documents'].extend(docs)
-            results['stats']['successful_files'] += 1
-            results['stats']['total_pages'] += len(docs)
-            results['stats']['total_size'] += os.path.getsize(file_path)
-            processed_hashes.add(file_hash)
-            
-            logger.info(f"Successfully processed {file_path}: {len(docs)} pages")
+            valid_files.append((file_path, file_size))
             
         except Exception as e:
             error_msg = f"Error processing {file_path}: {str(e)}"
@@ -147,6 +281,61 @@ def parse_multiple_pdfs(file_paths: List[str], api_key: Optional[str] = None) ->
             results['stats']['failed_files'] += 1
             logger.error(error_msg)
     
+    # Hash concurrently; hashlib releases the GIL while digesting
+    file_hashes = []
+    if valid_files:
+        max_workers = min(MAX_HASH_WORKERS, len(valid_files))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            file_hashes = list(executor.map(get_file_hash, [file_path for file_path, _ in valid_files]))
+    
+    # Check for duplicates in input order so the first copy of a file wins
+    pending = []
+    for (file_path, file_size), file_hash in zip(valid_files, file_hashes):
+        digest = bytes.fromhex(file_hash)
+        if digest in processed_hashes:
+            results['errors'].append({
+                'file_path': file_path,
+                'error': 'Duplicate file detected'
+            })
+            results['stats']['failed_files'] += 1
+            continue
+        
+        processed_hashes.add(digest)
+        pending.append((file_path, file_hash, file_size))
+    
+    # Parse all unique, valid files in one batched submission
+    if pending:
+        try:
+            batch = parse_pdfs_batch(
+                [file_path for file_path, _, _ in pending],
+                api_key,
+                file_hashes={file_path: file_hash for file_path, file_hash, _ in pending},
+                file_sizes={file_path: file_size for file_path, _, file_size in pending},
+                batch_id=start_time.isoformat()
+            )
+        except Exception as e:
+            # Client setup failed (e.g. missing API key): every pending file fails
+            logger.error(f"Error processing batch: {str(e)}")
+            batch = {
+                'documents': {},
+                'errors': [{'file_path': file_path, 'error': str(e)} for file_path, _, _ in pending]
+            }
+        
+        for file_path, _, file_size in pending:
+            docs = batch['documents'].get(file_path)
+            if docs is None:
+                continue
+            
+            results['documents'].extend(docs)
+            results['stats']['successful_files'] += 1
+            results['stats']['total_pages'] += len(docs)
+            results['stats']['total_size'] += file_size
+            
+            logger.info(f"Successfully processed {file_path}: {len(docs)} pages")
+        
+        results['errors'].extend(batch['errors'])
+        results['stats']['failed_files'] += len(batch['errors'])
+    
     # Calculate processing time
     end_time = datetime.now()
     results['stats']['processing_time'] = (end_time - start_time).total_seconds()
@@ -164,36 +353,61 @@ def get_file_hash(file_path: str) -> str:
         file_path (str): Path to the file
         
     Returns:
-        str: MD5 hash of the file
+        str: 128-bit BLAKE3 hash of the file
     """
     try:
-        with open(file_path, 'rb') as f:
-            file_content = f.read()
-        return hashlib.md5(file_content).hexdigest()
+        # BLAKE3 maps the file itself and hashes it with SIMD across multiple threads
+        file_hash = blake3(max_threads=blake3.AUTO)
+        file_hash.update_mmap(file_path)
+        return file_hash.hexdigest(length=HASH_DIGEST_SIZE)
+    except (OSError, ValueError):
+        # Fall back to streaming where mmap is unavailable (e.g. special files)
+        return _stream_file_hash(file_path)
     except Exception as e:
         logger.error(f"Error generating hash for {file_path}: {str(e)}")
         return ""
 
 
-def validate_pdf(file_path: str) -> bool:
+def _stream_file_hash(file_path: str) -> str:
+    """Hash a file by streaming it in fixed-size chunks."""
+    try:
+        with open(file_path, 'rb', buffering=0) as f:
+            # Python 3.11+ reuses one buffer via readinto, avoiding a bytes object per chunk
+            if sys.version_info >= (3, 11):
+                return hashlib.file_digest(f, blake3).hexdigest(length=HASH_DIGEST_SIZE)
+            
+            file_hash = blake3()
+            # Stream the file in 1 MiB chunks so memory stays flat regardless of file size
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                file_hash.update(chunk)
+            return file_hash.hexdigest(length=HASH_DIGEST_SIZE)
+    except Exception as e:
+        logger.error(f"Error generating hash for {file_path}: {str(e)}")
+        return ""
+
+
+def validate_pdf(file_path: str, size: Optional[int] = None) -> bool:
     """
     Validate if the file is a valid PDF and accessible.
     
     Args:
         file_path (str): Path to the file
+        size (Optional[int]): Known file size in bytes, skips the stat calls
         
     Returns:
         bool: True if valid PDF, False otherwise
     """
     try:
-        if not os.path.exists(file_path):
-            return False
+        if size is None:
+            if not os.path.exists(file_path):
+                return False
+            size = os.path.getsize(file_path)
             
         if not file_path.lower().endswith('.pdf'):
             return False
             
         # Check file size (max 50MB)
-        if os.path.getsize(file_path) > 50 * 1024 * 1024:
+        if size > 50 * 1024 * 1024:
             return False
             
         # Basic PDF validation (check for PDF header)
@@ -223,7 +437,7 @@ def get_document_stats(documents: List[Document]) -> Dict[str, Any]:
         'total_pages': 0,
         'total_size': 0,
         'files': {},
-        'languages': set(),
+        'languages': [],
         'avg_text_length': 0
     }
     
@@ -231,36 +445,46 @@ def get_document_stats(documents: List[Document]) -> Dict[str, Any]:
         return stats
     
     total_text_length = 0
+    arabic_pages = 0
+    files = defaultdict(lambda: {'pages': 0, 'size': 0, 'total_text_length': 0})
     
     for doc in documents:
-        # Count pages
-        stats['total_pages'] += 1
-        
         # Calculate text length
         text_length = len(doc.text)
         total_text_length += text_length
         
         # Track file information
-        file_name = doc.metadata.get('file_name', 'Unknown')
-        if file_name not in stats['files']:
-            stats['files'][file_name] = {
-                'pages': 0,
-                'size': doc.metadata.get('file_size', 0),
-                'total_text_length': 0
-            }
+        file_size = doc.metadata.get('file_size', 0)
+        entry = files[doc.metadata.get('file_name', 'Unknown')]
+        entry['pages'] += 1
+        entry['size'] = file_size
+        entry['total_text_length'] += text_length
+        stats['total_size'] += file_size
         
-        stats['files'][file_name]['pages'] += 1
-        stats['files'][file_name]['total_text_length'] += text_length
-        stats['total_size'] += doc.metadata.get('file_size', 0)
-        
-        # Detect language (basic Arabic detection)
-        if any('\u0600' <= char <= '\u06FF' for char in doc.text):
-            stats['languages'].add('Arabic')
-        else:
-            stats['languages'].add('English')
+        # Detect language (basic Arabic detection) on the head and tail of the text only
+        arabic_pages += _contains_arabic(doc.text)
+    
+    # Every document is one page
+    stats['total_pages'] = len(documents)
+    stats['files'] = dict(files)
     
     # Calculate averages
     stats['avg_text_length'] = total_text_length / len(documents)
-    stats['languages'] = list(stats['languages'])
     
-    return stats
\ No newline at end of file
+    # Languages are built once from the page counts instead of through a set
+    stats['languages'] = [
+        language for language, pages in (('Arabic', arabic_pages), ('English', len(documents) - arabic_pages))
+        if pages
+    ]
+    
+    return stats
+
+
+def _contains_arabic(text: str) -> bool:
+    """Check for Arabic characters, bounding the scan to a sample from each end of the text."""
+    if len(text) <= 2 * LANGUAGE_SAMPLE_SIZE:
+        return bool(_ARABIC_RE.search(text))
+    
+    # Language rarely flips mid-document, so the head and tail are representative
+    return bool(_ARABIC_RE.search(text, 0, LANGUAGE_SAMPLE_SIZE)
+                or _ARABIC_RE.search(text, len(text) - LANGUAGE_SAMPLE_SIZE))
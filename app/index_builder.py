@@ -4,10 +4,15 @@ from llama_index.vector_stores.neo4jvector import Neo4jVectorStore
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.embeddings.gemini import GeminiEmbedding
 from llama_index.embeddings.openai import OpenAIEmbedding
-from config.settings import NEO4J_PASSWORD, NEO4J_URI, NEO4J_USER, OPENAI_API_KEY
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from config.settings import (
+    NEO4J_PASSWORD, NEO4J_URI, NEO4J_USER, OPENAI_API_KEY,
+    EMBED_PROVIDER, EMBED_MODEL, EMBED_DEVICE
+)
 import os
 import logging
-from typing import List, Optional
+from functools import lru_cache
+from typing import Dict, List, Optional
 from llama_index.core.schema import Document
 import time
 from neo4j import GraphDatabase
@@ -15,6 +20,86 @@ from neo4j import GraphDatabase
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Maximum pooled Bolt connections held by the shared driver
+NEO4J_MAX_POOL_SIZE = 20
+
+# Known output dimensions, so startup doesn't need a live embedding call
+_EMBED_DIMS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+    "models/embedding-001": 768,
+    "BAAI/bge-small-en-v1.5": 384,
+    "intfloat/e5-small-v2": 384,
+}
+
+# Model used when EMBED_MODEL isn't set
+_DEFAULT_EMBED_MODELS = {
+    "openai": "text-embedding-3-large",
+    "huggingface": "BAAI/bge-small-en-v1.5",
+}
+
+# Cosine similarity a query must reach to reuse a cached answer; small local models score
+# unrelated questions higher than the API models do, so they need a stricter cut-off
+_CACHE_SIMILARITY_THRESHOLDS = {
+    "BAAI/bge-small-en-v1.5": 0.985,
+    "intfloat/e5-small-v2": 0.985,
+}
+DEFAULT_CACHE_SIMILARITY_THRESHOLD = 0.97
+
+# Inputs sent per embedding request; the OpenAI endpoint accepts up to 2048
+EMBED_BATCH_SIZE = 256
+
+# Nodes embedded and written to the vector store per insert batch
+INSERT_BATCH_SIZE = 2048
+
+# Chunk nodes deleted per transaction when clearing the database
+DELETE_BATCH_SIZE = 10000
+
+
+@lru_cache(maxsize=4)
+def get_embed_model(provider: str, model_name: str, device: Optional[str] = None) -> BaseEmbedding:
+    """
+    Create an embedding model once per process, so local models load their weights only once.
+    
+    Args:
+        provider: "openai" for the API, or "huggingface" for a local model
+        model_name: Embedding model name
+        device: Device for local models, e.g. "cuda" or "cpu"
+    """
+    if provider == "openai":
+        return OpenAIEmbedding(
+            api_key=OPENAI_API_KEY,
+            model=model_name,
+            embed_batch_size=EMBED_BATCH_SIZE
+        )
+    
+    if provider == "huggingface":
+        try:
+            from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        except ImportError as e:
+            raise ImportError(
+                "EMBED_PROVIDER=huggingface requires: pip install llama-index-embeddings-huggingface"
+            ) from e
+        return HuggingFaceEmbedding(model_name=model_name, device=device)
+    
+    raise ValueError(f"Unsupported EMBED_PROVIDER: {provider}")
+
+
+def get_embed_model_name() -> str:
+    """Return the configured embedding model, or the provider's default."""
+    return EMBED_MODEL or _DEFAULT_EMBED_MODELS.get(EMBED_PROVIDER, "")
+
+
+def get_cache_similarity_threshold(model_name: Optional[str] = None) -> float:
+    """
+    Return the response cache similarity threshold for an embedding model.
+    
+    Args:
+        model_name: Embedding model name (defaults to the configured model)
+    """
+    return _CACHE_SIMILARITY_THRESHOLDS.get(model_name or get_embed_model_name(), DEFAULT_CACHE_SIMILARITY_THRESHOLD)
+
 
 class IndexBuilder:
     """Enhanced index builder with Gemini embeddings and modern LlamaIndex Settings."""
@@ -38,6 +123,14 @@ class IndexBuilder:
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         
+        # Long-lived, thread-safe driver shared by all metadata operations.
+        # Creating it does not connect; connections are pooled on first use.
+        self._driver = GraphDatabase.driver(
+            self.neo4j_uri,
+            auth=(self.neo4j_user, self.neo4j_password),
+            max_connection_pool_size=NEO4J_MAX_POOL_SIZE
+        )
+        
         # Configure global settings first
         self._configure_settings()
         
@@ -50,10 +143,9 @@ class IndexBuilder:
 
         for attempt in range(max_retries):
             try:
-                with GraphDatabase.driver(self.neo4j_uri, auth=(self.neo4j_user, self.neo4j_password)) as driver:
-                    driver.verify_connectivity()
-                    logger.info("Neo4j is ready!")
-                    return True
+                self._driver.verify_connectivity()
+                logger.info("Neo4j is ready!")
+                return True
             except exceptions.ServiceUnavailable as e:
                 logger.warning(f"Neo4j not ready yet (attempt {attempt + 1}/{max_retries}): {e}")
                 time.sleep(retry_delay)
@@ -65,14 +157,14 @@ class IndexBuilder:
         """Configure global Settings instead of ServiceContext."""
         try:
             # embed_model = GeminiEmbedding(model_name="models/embedding-001")
-            embed_model = OpenAIEmbedding(
-                api_key=OPENAI_API_KEY,
-                model="text-embedding-3-large"  # or another OpenAI embedding model
-            )
-            node_parser = SentenceSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+            # Settings.embed_model also embeds queries, so indexing and querying share the model
+            self.embed_model_name = get_embed_model_name()
+            embed_model = get_embed_model(EMBED_PROVIDER, self.embed_model_name, EMBED_DEVICE)
+            # Kept on the builder too, so a long-lived builder chunks with its own settings
+            self.node_parser = SentenceSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
 
             Settings.embed_model = embed_model
-            Settings.node_parser = node_parser
+            Settings.node_parser = self.node_parser
             Settings.chunk_size = self.chunk_size
             Settings.chunk_overlap = self.chunk_overlap
             
@@ -88,9 +180,11 @@ class IndexBuilder:
             raise RuntimeError("Neo4j connection failed.")
 
         try:
-            # Get embedding dimension dynamically
-            embedding_dimension = len(Settings.embed_model.get_text_embedding("test"))
-            logger.info(f"Detected embedding dimension: {embedding_dimension}")
+            # Look up the embedding dimension, measuring it only for unknown models
+            embedding_dimension = _EMBED_DIMS.get(self.embed_model_name)
+            if embedding_dimension is None:
+                embedding_dimension = len(Settings.embed_model.get_text_embedding("test"))
+                logger.info(f"Detected embedding dimension: {embedding_dimension}")
             
             vector_store = Neo4jVectorStore(
                 url=self.neo4j_uri,
@@ -105,19 +199,48 @@ class IndexBuilder:
             logger.error(f"Failed to initialize Neo4j vector store: {str(e)}")
             raise
     
-    def build_index(self, documents: List[Document]) -> VectorStoreIndex:
-        """Build vector index from documents."""
+    def build_index(self,
+                    documents: List[Document],
+                    batch_size: Optional[int] = None,
+                    use_async: bool = False,
+                    chunk_size: Optional[int] = None) -> Optional[VectorStoreIndex]:
+        """
+        Build vector index from documents, skipping files that are already indexed.
+        
+        Args:
+            documents: Parsed documents to chunk, embed and insert
+            batch_size: Nodes embedded and written to Neo4j per batch (defaults to INSERT_BATCH_SIZE)
+            use_async: Send the embedding batches concurrently instead of one after another; the
+                embedder is shared process-wide, so only use this when every call runs on one event loop
+            chunk_size: Chunk size for these documents (defaults to the builder's chunk_size)
+        """
         try:
             if not documents:
                 raise ValueError("No documents provided for indexing")
             
+            # Skip files already in Neo4j so they aren't re-embedded and re-written
+            existing = set(self.get_existing_document_names())
+            if existing:
+                documents = [doc for doc in documents if doc.metadata.get('file_name') not in existing]
+                if not documents:
+                    logger.info("All documents already indexed")
+                    return None
+            
             logger.info(f"Building index for {len(documents)} documents")
             
             storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
             
+            # One builder serves every chunk size, so a different size needs only its own splitter
+            node_parser = self.node_parser
+            if chunk_size is not None and chunk_size != self.chunk_size:
+                node_parser = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=self.chunk_overlap)
+            
             index = VectorStoreIndex.from_documents(
                 documents,
                 storage_context=storage_context,
+                transformations=[node_parser],
+                insert_batch_size=batch_size or INSERT_BATCH_SIZE,
+                use_async=use_async,
                 show_progress=True
             )
             
@@ -149,19 +272,44 @@ class IndexBuilder:
             return []
 
         try:
-            with GraphDatabase.driver(self.neo4j_uri, auth=(self.neo4j_user, self.neo4j_password)) as driver:
-                query = "MATCH (c:Chunk) WHERE c.file_name IS NOT NULL RETURN DISTINCT c.file_name AS fileName"
-                records, _, _ = driver.execute_query(query)
-                file_names = sorted([record["fileName"] for record in records])
-                if file_names:
-                    logger.info(f"Found existing documents in Neo4j: {file_names}")
-                else:
-                    logger.info("No existing documents found in Neo4j.")
-                return file_names
+            query = (
+                "MATCH (c:Chunk) WHERE c.file_name IS NOT NULL "
+                "RETURN DISTINCT c.file_name AS fileName ORDER BY fileName"
+            )
+            records, _, _ = self._driver.execute_query(query)
+            file_names = [record["fileName"] for record in records]
+            if file_names:
+                logger.info(f"Found existing documents in Neo4j: {file_names}")
+            else:
+                logger.info("No existing documents found in Neo4j.")
+            return file_names
         except Exception as e:
             logger.error(f"Failed to query for existing documents: {str(e)}")
             return []
 
+    def get_existing_document_hashes(self) -> Dict[str, Optional[str]]:
+        """Query Neo4j for each indexed document name and its content hash (None if it was indexed without one)."""
+        if not self._wait_for_neo4j():
+            logger.error("Cannot check for existing documents, Neo4j is not available.")
+            return {}
+
+        try:
+            query = (
+                "MATCH (c:Chunk) WHERE c.file_name IS NOT NULL "
+                "RETURN c.file_name AS fileName, collect(DISTINCT c.file_hash)[0] AS fileHash "
+                "ORDER BY fileName"
+            )
+            records, _, _ = self._driver.execute_query(query)
+            file_hashes = {record["fileName"]: record["fileHash"] for record in records}
+            if file_hashes:
+                logger.info(f"Found existing documents in Neo4j: {list(file_hashes)}")
+            else:
+                logger.info("No existing documents found in Neo4j.")
+            return file_hashes
+        except Exception as e:
+            logger.error(f"Failed to query for existing documents: {str(e)}")
+            return {}
+
     def delete_all_documents(self):
         """
         Deletes all Chunk nodes and the associated vector index from Neo4j.
@@ -172,19 +320,31 @@ class IndexBuilder:
             return
 
         try:
-            with GraphDatabase.driver(self.neo4j_uri, auth=(self.neo4j_user, self.neo4j_password)) as driver:
-                # 1. Delete all nodes with the 'Chunk' label
-                driver.execute_query("MATCH (c:Chunk) DETACH DELETE c")
+            # CALL { ... } IN TRANSACTIONS needs an auto-commit transaction, so use session.run
+            with self._driver.session() as session:
+                # 1. Delete all nodes with the 'Chunk' label, in batches to bound transaction size
+                session.run(
+                    "MATCH (c:Chunk) "
+                    "CALL { WITH c DETACH DELETE c } "
+                    f"IN TRANSACTIONS OF {DELETE_BATCH_SIZE} ROWS"
+                ).consume()
                 logger.info("Deleted all 'Chunk' nodes from Neo4j.")
                 
-                # 2. Drop the vector index (default name is 'vector')
-                indexes, _, _ = driver.execute_query("SHOW INDEXES")
+                # 2. Drop the vector index (default name is 'vector') in one round-trip
                 vector_index_name = "vector" 
-                if any(index['name'] == vector_index_name for index in indexes):
-                    driver.execute_query(f"DROP INDEX {vector_index_name}")
-                    logger.info(f"Dropped vector index '{vector_index_name}'.")
-                
-                logger.info("Successfully cleared all indexed documents from the database.")
+                session.run(f"DROP INDEX {vector_index_name} IF EXISTS").consume()
+                logger.info(f"Dropped vector index '{vector_index_name}' if it existed.")
+            
+            # 3. Recreate the empty index through the existing store, so this builder and every
+            #    index already built on it keep working without a new driver
+            self.vector_store.create_new_index()
+            logger.info(f"Recreated empty vector index '{vector_index_name}'.")
+            
+            logger.info("Successfully cleared all indexed documents from the database.")
         except Exception as e:
             logger.error(f"Failed to delete all documents: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    def close(self):
+        """Close the shared Neo4j driver and release its connection pool."""
+        self._driver.close()
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Hashable, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class _SimilarityCache:
+    """Fixed-size LRU of responses keyed by normalized query embeddings."""
+
+    def __init__(self, capacity: int, threshold: float):
+        self.capacity = capacity
+        self.threshold = threshold
+        self._embeddings: Optional[np.ndarray] = None  # (capacity, dim), allocated on first insert
+        self._responses: List[Dict[str, Any]] = []
+        self._stored_at = np.zeros(capacity, dtype=np.float64)
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+        self._clock = 0
+
+    def get(self, embedding: np.ndarray, min_stored_at: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Return the cached response whose key has cosine similarity >= threshold, if any."""
+        count = len(self._responses)
+        if not count:
+            return None
+
+        similarities = self._embeddings[:count] @ embedding
+        if min_stored_at is not None:
+            # Expired entries can never match
+            similarities[self._stored_at[:count] < min_stored_at] = -np.inf
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+
+        self._touch(best)
+        return self._responses[best]
+
+    def put(self, embedding: np.ndarray, response: Dict[str, Any], stored_at: float):
+        """Store a response, evicting the least recently used entry when full."""
+        if self._embeddings is None:
+            self._embeddings = np.empty((self.capacity, embedding.shape[0]), dtype=np.float32)
+
+        if len(self._responses) < self.capacity:
+            slot = len(self._responses)
+            self._responses.append(response)
+        else:
+            slot = int(np.argmin(self._last_used))
+            self._responses[slot] = response
+
+        self._embeddings[slot] = embedding
+        self._stored_at[slot] = stored_at
+        self._touch(slot)
+
+    def _touch(self, slot: int):
+        self._clock += 1
+        self._last_used[slot] = self._clock
+
+
+class QueryCache:
+    """Thread-safe response cache with an exact-match layer and a semantic-similarity fallback."""
+
+    def __init__(self,
+                 max_size: int = 500,
+                 similarity_threshold: float = 0.97,
+                 ttl: Optional[float] = 600.0,
+                 exact_max_size: Optional[int] = None):
+        """
+        Initialize the query cache.
+
+        Args:
+            max_size: Maximum number of responses kept per similarity namespace
+            similarity_threshold: Minimum cosine similarity for a cached response to be reused
+            ttl: Seconds a response stays valid, or None to keep responses until evicted
+            exact_max_size: Maximum number of exact-match entries (defaults to max_size)
+        """
+        self.max_size = max_size
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.exact_max_size = exact_max_size or max_size
+
+        self._lock = threading.RLock()
+        self._exact: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # One similarity index per namespace (e.g. pipeline settings) so answers never cross them
+        self._similar: Dict[Hashable, _SimilarityCache] = {}
+
+    def get_exact(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the response stored under this exact key, if present and not expired."""
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is None:
+                return None
+
+            stored_at, response = entry
+            if self._expired(stored_at):
+                del self._exact[key]
+                return None
+
+            self._exact.move_to_end(key)
+            return response
+
+    def get_similar(self, namespace: Hashable, embedding: np.ndarray) -> Optional[Dict[str, Any]]:
+        """Return a response cached in this namespace for a sufficiently similar normalized embedding."""
+        with self._lock:
+            cache = self._similar.get(namespace)
+            if cache is None:
+                return None
+
+            min_stored_at = time.monotonic() - self.ttl if self.ttl is not None else None
+            return cache.get(embedding, min_stored_at)
+
+    def put_exact(self, key: str, response: Dict[str, Any]):
+        """Store a response under an exact key, evicting the oldest entry when full."""
+        with self._lock:
+            self._exact[key] = (time.monotonic(), response)
+            self._exact.move_to_end(key)
+            if len(self._exact) > self.exact_max_size:
+                self._exact.popitem(last=False)
+
+    def put(self, key: str, namespace: Hashable, embedding: np.ndarray, response: Dict[str, Any]):
+        """Store a response under both its exact key and its embedding."""
+        with self._lock:
+            cache = self._similar.get(namespace)
+            if cache is None:
+                cache = self._similar[namespace] = _SimilarityCache(self.max_size, self.similarity_threshold)
+            cache.put(embedding, response, time.monotonic())
+            self.put_exact(key, response)
+
+    def clear(self):
+        """Drop all cached responses, e.g. after the index contents change."""
+        with self._lock:
+            self._exact.clear()
+            self._similar.clear()
+        logger.info("Query cache cleared")
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl is not None and time.monotonic() - stored_at > self.ttl
@@ -2,14 +2,162 @@ from llama_index.core.query_engine import CitationQueryEngine
 from llama_index.llms.gemini import Gemini
 from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.llms import ChatMessage
-from config.settings import GEMINI_API_KEY, LLM_MODEL, SYSTEM_PROMPT
+from llama_index.core.schema import QueryBundle
+from llama_index.core import Settings
+from app.query_cache import QueryCache
+from config.settings import GEMINI_API_KEY, LLM_MODEL, SYSTEM_PROMPT, SYSTEM_PROMPT_EN, SYSTEM_PROMPT_AR
 import logging
 import re
-from typing import Dict, Any, List
+import hashlib
+import numpy as np
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from functools import cached_property
+from typing import Dict, Any, List, Optional, Tuple
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# All citation patterns fused into one alternation so the response text is scanned once.
+# The bracketed forms are matched in a lookahead that consumes only the opening bracket,
+# so a "filename.pdf - Page X" cite inside their span is still found
+_CITE_ALL = re.compile(
+    r'\[(?=Source:\s*(?P<f1>[^,]+\.pdf),\s*Page:\s*(?P<p1>\d+)\])'  # [Source: filename.pdf, Page: X]
+    r'|(?:(?P<f2>[^,\s]+\.pdf)\s*-\s*Page\s*(?P<p2>\d+))'          # filename.pdf - Page X
+    r'|\((?=(?P<f3>[^,()]+\.pdf),\s*p\.\s*(?P<p3>\d+)\))',         # (filename.pdf, p. X)
+    re.IGNORECASE
+)
+
+# Phrases signalling that no answer was found
+_NO_ANSWER_INDICATORS = (
+    "no answer found",
+    "no information found",
+    "no relevant information",
+    "not found in the documents",
+    "no sources found",
+    "cannot find",
+    "unable to find",
+    "not mentioned in the documents",
+    "no specific information",
+)
+
+# Phrases showing the answer is tied to the sources
+_FACTUAL_INDICATORS = ("according to", "states that", "specifies", "indicates")
+
+# Each indicator set matched in one case-insensitive scan
+_NO_ANSWER_RE = re.compile("|".join(map(re.escape, _NO_ANSWER_INDICATORS)), re.IGNORECASE)
+_FACTUAL_RE = re.compile("|".join(map(re.escape, _FACTUAL_INDICATORS)), re.IGNORECASE)
+
+
+# Recent messages (3 exchanges) considered as conversation context, newest first
+# until memory_token_limit is reached
+_CONTEXT_MESSAGES = 6
+
+# Word counts above this value don't change the confidence score
+_WORD_COUNT_CAP = 51
+
+# Response synthesis mode used unless a query asks for another one
+_DEFAULT_RESPONSE_MODE = "tree_summarize"
+
+# Questions shorter than this many words are treated as simple lookups and answered
+# with a smaller retrieval and a single-call synthesis mode
+_SHORT_QUESTION_WORDS = 8
+_SHORT_QUESTION_OPTIONS = (2, "compact")
+
+# Question language is told from its script: Arabic only, Latin only, or mixed/other
+_ARABIC_RE = re.compile(r'[\u0600-\u06FF]')
+_LATIN_RE = re.compile(r'[A-Za-z]')
+_SYSTEM_PROMPTS = {
+    "ar": SYSTEM_PROMPT_AR,
+    "en": SYSTEM_PROMPT_EN,
+    "auto": SYSTEM_PROMPT,
+}
+
+
+def _confidence_score(num_citations: int, num_sources: int, word_count: int, has_factual_indicator: bool) -> float:
+    """Score a response from precomputed scalar features."""
+    confidence = 0.3  # Base confidence
+    
+    # Increase confidence based on citations
+    if num_citations:
+        confidence += min(0.4, num_citations * 0.1)  # Up to 0.4 for citations
+    
+    # Increase confidence based on number of source documents
+    if num_sources > 0:
+        confidence += min(0.2, num_sources * 0.05)  # Up to 0.2 for sources
+    
+    # Increase confidence if response is detailed
+    if word_count > 50:
+        confidence += 0.1
+    elif word_count > 20:
+        confidence += 0.05
+    
+    # Decrease confidence if response is too short
+    if word_count < 10:
+        confidence -= 0.2
+    
+    # Decrease confidence if no specific citations
+    if not num_citations:
+        confidence -= 0.3
+    
+    if has_factual_indicator:
+        confidence += 0.1
+    
+    return min(max(confidence, 0.0), 1.0)
+
+
+@dataclass(slots=True)
+class Citation:
+    """A file/page reference supporting an answer."""
+    file: str
+    page: int
+    text_snippet: str = ""
+    score: float = 0.0
+    type: str = "node"
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass(slots=True)
+class SourceDocument:
+    """A retrieved chunk shown alongside an answer."""
+    file_name: str
+    page: int
+    text_snippet: str = ""
+    relevance_score: float = 0.0
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass(slots=True)
+class _PendingQuery:
+    """A question past the exact-match cache, carried between the sync and async query steps."""
+    question: str
+    options: Tuple[int, str, str]
+    exact_key: str
+    query_str: str
+    use_context: bool
+    cache_key: Optional[np.ndarray] = None
+
+
+def _detect_language(text: str) -> str:
+    """Return "ar" or "en" for single-script text and "auto" otherwise."""
+    has_arabic = _ARABIC_RE.search(text) is not None
+    has_latin = _LATIN_RE.search(text) is not None
+    if has_arabic and not has_latin:
+        return "ar"
+    if has_latin and not has_arabic:
+        return "en"
+    return "auto"
+
+
+def _snip(text: str, limit: int) -> str:
+    """Truncate text to limit characters, only allocating a new string when it is longer."""
+    return text if len(text) <= limit else text[:limit] + "..."
+
 
 class QueryEngine:
     """Query engine focused on reliable citation-based responses."""
@@ -18,28 +166,76 @@ class QueryEngine:
                  index,
                  memory_token_limit: int = 3000,
                  temperature: float = 0.1,
-                 similarity_top_k: int = 5):
+                 similarity_top_k: int = 5,
+                 cache_size: int = 256,
+                 cache_similarity_threshold: float = 0.97,
+                 exact_cache_size: int = 512,
+                 cache_ttl: Optional[float] = 600.0,
+                 cache: Optional[QueryCache] = None):
         """
         Initialize the query engine.
         
         Args:
             index: LlamaIndex vector index
-            memory_token_limit: Maximum tokens to keep in memory
+            memory_token_limit: Maximum tokens to keep in memory and to add as conversation context
             temperature: LLM temperature for response generation
             similarity_top_k: Number of similar chunks to retrieve
+            cache_size: Maximum number of responses kept in the similarity cache
+            cache_similarity_threshold: Minimum cosine similarity for a cached response to be reused
+            exact_cache_size: Maximum number of responses kept for exact repeat questions
+            cache_ttl: Seconds a cached response stays valid, or None for no expiry
+            cache: Response cache to use, e.g. one shared between engines; the cache_* settings
+                   above only apply when a new cache is created
         """
         self.index = index
         self.memory_token_limit = memory_token_limit
         self.temperature = temperature
         self.similarity_top_k = similarity_top_k
         
-        # Initialize components
-        self.llm = self._create_llm()
-        self.memory = self._create_memory()
-        self.citation_engine = self._create_citation_engine()
+        # Exact repeats in the same conversation context skip even the query embedding, and
+        # near-duplicates are served without retrieval or generation; similarity lookups are
+        # namespaced by (top_k, response_mode, language) so answers never cross pipeline settings
+        self._cache = cache if cache is not None else QueryCache(
+            max_size=cache_size,
+            similarity_threshold=cache_similarity_threshold,
+            ttl=cache_ttl,
+            exact_max_size=exact_cache_size
+        )
+        
+        # Mirror of the latest (message, token count) pairs so context building never
+        # materializes or re-tokenizes the full history
+        self._recent = deque(maxlen=_CONTEXT_MESSAGES)
+        
+        # LLMs by prompt language and citation engines by (top_k, response_mode, language),
+        # built on first use
+        self._llms: Dict[str, Gemini] = {}
+        self._engines: Dict[Tuple[int, str, str], CitationQueryEngine] = {}
+    
+    # Components are created on first use so constructing an engine costs no setup
+    @cached_property
+    def memory(self) -> ChatMemoryBuffer:
+        return self._create_memory()
+    
+    def warm_up(self, similarity_top_k: Optional[int] = None, response_mode: Optional[str] = None):
+        """
+        Create the memory, LLMs and citation engines now instead of on the first query.
+        
+        Args:
+            similarity_top_k: Chunks the caller will retrieve per question (defaults to similarity_top_k)
+            response_mode: Response synthesis mode the caller will use (defaults to tree_summarize)
+        """
+        self.memory
+        # The question's language picks the engine, so build one per prompt language
+        for language in _SYSTEM_PROMPTS:
+            self._get_citation_engine(
+                similarity_top_k if similarity_top_k is not None else self.similarity_top_k,
+                response_mode or _DEFAULT_RESPONSE_MODE,
+                language
+            )
+        logger.info("Query engine warmed up")
     
-    def _create_llm(self) -> Gemini:
-        """Create Gemini LLM instance."""
+    def _create_llm(self, language: str) -> Gemini:
+        """Create Gemini LLM instance with the system prompt for this language."""
         try:
             if not GEMINI_API_KEY:
                 raise ValueError("GEMINI_API_KEY is required")
@@ -47,9 +243,10 @@ class QueryEngine:
             llm = Gemini(
                 api_key=GEMINI_API_KEY,
                 model=LLM_MODEL,
-                temperature=self.temperature
+                temperature=self.temperature,
+                system_prompt=_SYSTEM_PROMPTS[language]
             )
-            logger.info("Gemini LLM initialized successfully")
+            logger.info(f"Gemini LLM initialized successfully (language={language})")
             return llm
         except Exception as e:
             logger.error(f"Failed to initialize LLM: {str(e)}")
@@ -67,290 +264,359 @@ class QueryEngine:
             logger.error(f"Failed to create memory: {str(e)}")
             raise Exception(f"Memory creation failed: {str(e)}")
     
-    def _create_citation_engine(self) -> CitationQueryEngine:
+    def _create_citation_engine(self, similarity_top_k: int, response_mode: str, language: str) -> CitationQueryEngine:
         """Create citation query engine with custom prompt."""
         try:
-            # Custom system prompt for better citation formatting
-            
+            # The system prompt lives on the LLM: from_args has no system_prompt and would hand
+            # it to the retriever, while an LLM-level prompt reaches every synthesis mode
             citation_engine = CitationQueryEngine.from_args(
                 index=self.index,
-                llm=self.llm,
-                similarity_top_k=self.similarity_top_k,
-                response_mode="tree_summarize",
-                system_prompt=SYSTEM_PROMPT
+                llm=self._get_llm(language),
+                similarity_top_k=similarity_top_k,
+                response_mode=response_mode
             )
-            logger.info("Citation query engine created successfully")
+            logger.info(f"Citation query engine created successfully (top_k={similarity_top_k}, mode={response_mode}, language={language})")
             return citation_engine
         except Exception as e:
             logger.error(f"Failed to create citation engine: {str(e)}")
             raise Exception(f"Citation engine creation failed: {str(e)}")
     
-    def query(self, question: str) -> Dict[str, Any]:
+    def _get_llm(self, language: str) -> Gemini:
+        """Return the LLM for this prompt language, creating it on first use."""
+        llm = self._llms.get(language)
+        if llm is None:
+            llm = self._llms[language] = self._create_llm(language)
+        return llm
+    
+    def _get_citation_engine(self, similarity_top_k: int, response_mode: str, language: str) -> CitationQueryEngine:
+        """Return the citation engine for these settings, creating it on first use."""
+        key = (similarity_top_k, response_mode, language)
+        engine = self._engines.get(key)
+        if engine is None:
+            engine = self._engines[key] = self._create_citation_engine(similarity_top_k, response_mode, language)
+        return engine
+    
+    def _resolve_options(self, question: str, top_k: Optional[int], response_mode: Optional[str]) -> Tuple[int, str, str]:
+        """Pick retrieval size, synthesis mode and prompt language, using a light pipeline for short lookups."""
+        language = _detect_language(question)
+        if top_k is None and response_mode is None:
+            if len(question.split(None, _SHORT_QUESTION_WORDS)) < _SHORT_QUESTION_WORDS:
+                return (*_SHORT_QUESTION_OPTIONS, language)
+        
+        return (
+            top_k if top_k is not None else self.similarity_top_k,
+            response_mode or _DEFAULT_RESPONSE_MODE,
+            language
+        )
+    
+    def query(self,
+              question: str,
+              top_k: Optional[int] = None,
+              response_mode: Optional[str] = None,
+              use_context: bool = True) -> Dict[str, Any]:
         """
         Process a user question and return response with citations.
         
         Args:
             question (str): User's question
+            top_k: Chunks to retrieve for this question; short questions default to a smaller retrieval
+            response_mode: Response synthesis mode for this question, e.g. "compact"
+            use_context: Whether the question is part of the conversation: prepend the recent
+                conversation and record the exchange in memory. Pass False for stateless
+                questions, e.g. ones answered concurrently.
             
         Returns:
             Dict[str, Any]: Response with answer and citations
         """
         try:
-            if not question.strip():
-                return {
-                    "answer": "Please provide a valid question.",
-                    "citations": [],
-                    "sources": [],
-                    "confidence": 0.0,
-                    "source_documents": []
-                }
-            
-            logger.info(f"Processing question: {question[:100]}...")
+            pending, answered = self._start_query(question, top_k, response_mode, use_context)
+            if answered is not None:
+                return answered
             
-            # Add conversation context if memory exists
-            contextualized_question = self._add_context(question)
+            # Embed once: the vector keys the cache and is reused for retrieval
+            embedding = Settings.embed_model.get_query_embedding(pending.query_str)
+            cached = self._lookup_similar(pending, embedding)
+            if cached is not None:
+                return cached
             
             # Get response from citation engine
-            response = self.citation_engine.query(contextualized_question)
-            response_text = str(response)
-            
-            # Extract citations and metadata from source nodes
-            citations = self._extract_citations_from_response(response)
-            sources = self._extract_sources_from_response(response)
-            source_documents = self._extract_source_documents(response)
-            
-            # Add to memory for context - FIXED: Use proper ChatMessage format
-            user_message = ChatMessage(role="user", content=question)
-            assistant_message = ChatMessage(role="assistant", content=response_text)
-            
-            self.memory.put(user_message)
-            self.memory.put(assistant_message)
-            
-            # Check if response indicates no answer found
-            if self._is_no_answer_response(response_text):
-                return {
-                    "answer": "No answer found in the provided documents.",
-                    "citations": [],
-                    "sources": [],
-                    "confidence": 0.0,
-                    "source_documents": []
-                }
-            
-            # Calculate confidence based on response quality and citations
-            confidence = self._calculate_confidence(response_text, citations, len(source_documents))
-            
-            return {
-                "answer": response_text,
-                "citations": citations,
-                "sources": sources,
-                "confidence": confidence,
-                "source_documents": source_documents
-            }
+            response = self._get_citation_engine(*pending.options).query(
+                QueryBundle(query_str=pending.query_str, embedding=embedding)
+            )
+            return self._finish_query(pending, response)
             
         except Exception as e:
-            logger.error(f"Error processing query: {str(e)}")
-            return {
-                "answer": f"Error processing your question: {str(e)}",
-                "citations": [],
-                "sources": [],
-                "confidence": 0.0,
-                "source_documents": []
-            }
+            logger.error("Error processing query: %s", e)
+            return self._empty_response(f"Error processing your question: {str(e)}")
     
-    def _add_context(self, question: str) -> str:
-        """Add conversation context to the question if memory exists."""
-        try:
-            # Get conversation history from memory
-            chat_history = self.memory.get()
+    async def aquery(self,
+                     question: str,
+                     top_k: Optional[int] = None,
+                     response_mode: Optional[str] = None,
+                     use_context: bool = True) -> Dict[str, Any]:
+        """
+        Async variant of query; awaits retrieval and generation without blocking the event loop.
+        
+        Args:
+            question (str): User's question
+            top_k: Chunks to retrieve for this question; short questions default to a smaller retrieval
+            response_mode: Response synthesis mode for this question, e.g. "compact"
+            use_context: Whether the question is part of the conversation: prepend the recent
+                conversation and record the exchange in memory. Pass False for stateless
+                questions, e.g. ones answered concurrently.
             
-            if not chat_history:
-                return question
+        Returns:
+            Dict[str, Any]: Response with answer and citations
+        """
+        try:
+            pending, answered = self._start_query(question, top_k, response_mode, use_context)
+            if answered is not None:
+                return answered
             
-            # Format context with recent conversation
-            context_str = "Previous conversation context:\n"
-            for msg in chat_history[-6:]:  # Last 6 messages (3 exchanges)
-                if hasattr(msg, 'content') and hasattr(msg, 'role'):
-                    context_str += f"{msg.role}: {msg.content}\n"
+            # Embed once: the vector keys the cache and is reused for retrieval
+            embedding = await Settings.embed_model.aget_query_embedding(pending.query_str)
+            cached = self._lookup_similar(pending, embedding)
+            if cached is not None:
+                return cached
             
-            contextualized = f"{context_str}\nCurrent question: {question}"
-            return contextualized
+            # Get response from citation engine
+            response = await self._get_citation_engine(*pending.options).aquery(
+                QueryBundle(query_str=pending.query_str, embedding=embedding)
+            )
+            return self._finish_query(pending, response)
             
         except Exception as e:
-            logger.warning(f"Failed to add context: {str(e)}")
-            return question
+            logger.error("Error processing query: %s", e)
+            return self._empty_response(f"Error processing your question: {str(e)}")
     
-    def _extract_citations_from_response(self, response) -> List[Dict[str, Any]]:
-        """Extract citations from the response object and text."""
-        citations = []
+    def _start_query(self,
+                     question: str,
+                     top_k: Optional[int],
+                     response_mode: Optional[str],
+                     use_context: bool) -> Tuple[Optional[_PendingQuery], Optional[Dict[str, Any]]]:
+        """
+        Resolve a question's settings and answer it from the exact-match cache if possible.
         
-        try:
-            # Method 1: Extract from source nodes (most reliable)
-            if hasattr(response, 'source_nodes'):
-                for i, node in enumerate(response.source_nodes):
-                    metadata = node.metadata
-                    file_name = metadata.get('file_name', f'Document_{i+1}')
-                    page_num = metadata.get('page', 1)
-                    
-                    citation = {
-                        "file": file_name,
-                        "page": page_num,
-                        "text_snippet": node.text[:200] + "..." if len(node.text) > 200 else node.text,
-                        "score": getattr(node, 'score', 0.0)
-                    }
-                    citations.append(citation)
-            
-            # Method 2: Extract from response text using regex patterns
-            response_text = str(response)
-            text_citations = self._extract_citations_from_text(response_text)
-            
-            # Merge citations, prioritizing source nodes
-            file_page_pairs = {(c['file'], c['page']) for c in citations}
-            for text_cite in text_citations:
-                pair = (text_cite['file'], text_cite['page'])
-                if pair not in file_page_pairs:
-                    citations.append(text_cite)
-            
-        except Exception as e:
-            logger.warning(f"Error extracting citations: {str(e)}")
+        Returns:
+            Tuple of (pending query, None), or (None, response) when no retrieval is needed
+        """
+        if not question.strip():
+            return None, self._empty_response("Please provide a valid question.")
         
-        return citations
+        logger.info("Processing question: %.100s...", question)
+        
+        options = self._resolve_options(question, top_k, response_mode)
+        exact_key = self._exact_cache_key(question, options, use_context)
+        cached = self._cache.get_exact(exact_key)
+        if cached is not None:
+            logger.info("Serving response from exact-match cache")
+            return None, self._serve_cached(question, cached, use_context)
+        
+        # Add conversation context if memory exists
+        query_str = self._add_context(question) if use_context and self._recent else question
+        return _PendingQuery(question, options, exact_key, query_str, use_context), None
     
-    def _extract_citations_from_text(self, text: str) -> List[Dict[str, Any]]:
-        """Extract citations from response text using multiple patterns."""
-        citations = []
+    def _lookup_similar(self, pending: _PendingQuery, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """Answer a pending query from the similarity cache, keeping its normalized embedding for storage."""
+        pending.cache_key = self._normalize(embedding)
+        cached = self._cache.get_similar(pending.options, pending.cache_key)
+        if cached is None:
+            return None
         
-        # Pattern 1: [Source: filename.pdf, Page: X]
-        pattern1 = r'\[Source:\s*([^,]+\.pdf),\s*Page:\s*(\d+)\]'
-        matches1 = re.findall(pattern1, text, re.IGNORECASE)
+        logger.info("Serving response from similarity cache")
+        self._cache.put_exact(pending.exact_key, cached)
+        return self._serve_cached(pending.question, cached, pending.use_context)
+    
+    def _finish_query(self, pending: _PendingQuery, response) -> Dict[str, Any]:
+        """Build the answer for a pending query from the citation engine response and cache it."""
+        result = self._build_response(pending.question, response, remember=pending.use_context)
+        self._cache.put(pending.exact_key, pending.options, pending.cache_key, result)
+        return dict(result)
+    
+    def _serve_cached(self, question: str, cached: Dict[str, Any], use_context: bool) -> Dict[str, Any]:
+        """Return a copy of a cached answer, recording the exchange when it is part of the conversation."""
+        if use_context:
+            self._remember(question, cached["answer"])
+        return dict(cached)
+    
+    def _build_response(self, question: str, response, remember: bool = True) -> Dict[str, Any]:
+        """Turn a citation engine response into the answer dict, recording the exchange in memory if asked."""
+        # Stringify once; every helper below works on this text
+        response_text = str(response)
+        
+        # Extract citations and metadata from source nodes
+        citations, sources, source_documents = self._extract_all(response, response_text)
         
-        for file_name, page in matches1:
-            citations.append({
-                "file": file_name.strip(),
-                "page": int(page),
-                "type": "text_citation"
-            })
+        # Add to memory for context
+        if remember:
+            self._remember(question, response_text)
         
-        # Pattern 2: filename.pdf - Page X
-        pattern2 = r'([^,\s]+\.pdf)\s*-\s*Page\s*(\d+)'
-        matches2 = re.findall(pattern2, text, re.IGNORECASE)
+        # Check if response indicates no answer found
+        if self._is_no_answer_response(response_text):
+            return self._empty_response("No answer found in the provided documents.")
         
-        for file_name, page in matches2:
-            citations.append({
-                "file": file_name.strip(),
-                "page": int(page),
-                "type": "text_citation"
-            })
+        # Calculate confidence based on response quality and citations
+        confidence = self._calculate_confidence(response_text, citations, len(source_documents))
         
-        # Pattern 3: (filename.pdf, p. X)
-        pattern3 = r'\(([^,]+\.pdf),\s*p\.\s*(\d+)\)'
-        matches3 = re.findall(pattern3, text, re.IGNORECASE)
+        return {
+            "answer": response_text,
+            "citations": citations,
+            "sources": sources,
+            "confidence": confidence,
+            "source_documents": source_documents
+        }
+    
+    def _remember(self, question: str, answer: str):
+        """Record a question/answer exchange in conversation memory."""
+        # FIXED: Use proper ChatMessage format
+        user_message = ChatMessage(role="user", content=question)
+        assistant_message = ChatMessage(role="assistant", content=answer)
         
-        for file_name, page in matches3:
-            citations.append({
-                "file": file_name.strip(),
-                "page": int(page),
-                "type": "text_citation"
-            })
+        self.memory.put_messages([user_message, assistant_message])
         
-        return citations
+        # Count tokens once here, with the memory's tokenizer, so _context_messages can apply
+        # the token limit without tokenizing the history on every query
+        tokenizer = self.memory.tokenizer_fn
+        self._recent.extend((msg, len(tokenizer(msg.content))) for msg in (user_message, assistant_message))
+    
+    def _exact_cache_key(self, question: str, options: Tuple[int, str, str], use_context: bool) -> str:
+        """Key a question together with its pipeline settings and, if used, the recent conversation."""
+        key = hashlib.blake2b(question.strip().lower().encode(), digest_size=16)
+        key.update(f"|{options[0]}|{options[1]}|{options[2]}".encode())
+        if use_context:
+            for msg in self._context_messages():  # Same window as _add_context
+                key.update(f"|{msg.role}:{msg.content}".encode())
+        return key.hexdigest()
+    
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        """Unit-normalize an embedding so a dot product gives cosine similarity."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
     
-    def _extract_sources_from_response(self, response) -> List[str]:
-        """Extract unique source files from response."""
+    @staticmethod
+    def _empty_response(answer: str) -> Dict[str, Any]:
+        """Build a response dict with no citations or sources."""
+        return {
+            "answer": answer,
+            "citations": [],
+            "sources": [],
+            "confidence": 0.0,
+            "source_documents": []
+        }
+    
+    def _context_messages(self) -> List[ChatMessage]:
+        """Return the most recent messages that fit in memory_token_limit, oldest first."""
+        messages = []
+        budget = self.memory_token_limit
+        for msg, tokens in reversed(self._recent):
+            budget -= tokens
+            if budget < 0:
+                break
+            messages.append(msg)
+        messages.reverse()
+        return messages
+    
+    def _add_context(self, question: str) -> str:
+        """Add conversation context to the question if memory exists."""
+        messages = self._context_messages()
+        if not messages:
+            return question
+        
+        # Format context with recent conversation, joined once at the end
+        parts = ["Previous conversation context:"]
+        parts.extend(f"{msg.role}: {msg.content}" for msg in messages)
+        parts.append(f"\nCurrent question: {question}")
+        return "\n".join(parts)
+    
+    def _extract_all(self, response, response_text: str):
+        """
+        Extract citations, unique sources and source documents in one pass over the source nodes.
+        
+        Returns:
+            Tuple of (citations, sources, source_documents)
+        """
+        citations = []
         sources = set()
+        documents = []
         
         try:
-            # From source nodes
-            if hasattr(response, 'source_nodes'):
-                for node in response.source_nodes:
-                    file_name = node.metadata.get('file_name')
-                    if file_name:
-                        sources.add(file_name)
-            
-            # From response text
-            response_text = str(response)
-            citations = self._extract_citations_from_text(response_text)
-            for citation in citations:
-                sources.add(citation['file'])
+            # Source nodes are the most reliable source of citations
+            for i, node in enumerate(getattr(response, 'source_nodes', None) or []):
+                metadata = node.metadata
+                file_name = metadata.get('file_name')
+                page_num = metadata.get('page', 1)
+                text = node.text
+                score = getattr(node, 'score', 0.0)
                 
-        except Exception as e:
-            logger.warning(f"Error extracting sources: {str(e)}")
+                citations.append(Citation(
+                    file=file_name or f'Document_{i+1}',
+                    page=page_num,
+                    text_snippet=_snip(text, 200),
+                    score=score
+                ))
+                documents.append(SourceDocument(
+                    file_name=file_name or 'Unknown',
+                    page=page_num,
+                    text_snippet=_snip(text, 300),
+                    relevance_score=score,
+                    metadata=metadata
+                ))
+                if file_name:
+                    sources.add(file_name)
+            
+            # Merge citations found in the response text, prioritizing source nodes
+            file_page_pairs = {(c.file, c.page) for c in citations}
+            for text_cite in self._extract_citations_from_text(response_text):
+                sources.add(text_cite.file)
+                pair = (text_cite.file, text_cite.page)
+                if pair not in file_page_pairs:
+                    citations.append(text_cite)
+            
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            logger.warning("Error extracting citations: %s", e)
         
-        return list(sources)
+        return citations, list(sources), documents
     
-    def _extract_source_documents(self, response) -> List[Dict[str, Any]]:
-        """Extract detailed source document information."""
-        documents = []
+    def _extract_citations_from_text(self, text: str) -> List[Citation]:
+        """Extract citations from response text using multiple patterns."""
+        citations = []
         
-        try:
-            if hasattr(response, 'source_nodes'):
-                for node in response.source_nodes:
-                    doc_info = {
-                        "file_name": node.metadata.get('file_name', 'Unknown'),
-                        "page": node.metadata.get('page', 1),
-                        "text_snippet": node.text[:300] + "..." if len(node.text) > 300 else node.text,
-                        "relevance_score": getattr(node, 'score', 0.0),
-                        "metadata": node.metadata
-                    }
-                    documents.append(doc_info)
-        except Exception as e:
-            logger.warning(f"Error extracting source documents: {str(e)}")
+        for match in _CITE_ALL.finditer(text):
+            f1, p1, f2, p2, f3, p3 = match.groups()
+            citations.append(Citation(
+                file=(f1 or f2 or f3).strip(),
+                page=int(p1 or p2 or p3),
+                type="text_citation"
+            ))
         
-        return documents
+        return citations
     
     def _is_no_answer_response(self, response_text: str) -> bool:
         """Check if response indicates no answer found."""
-        no_answer_indicators = [
-            "no answer found",
-            "no information found",
-            "no relevant information",
-            "not found in the documents",
-            "no sources found",
-            "cannot find",
-            "unable to find",
-            "not mentioned in the documents",
-            "no specific information"
-        ]
-        
-        response_lower = response_text.lower()
-        return any(indicator in response_lower for indicator in no_answer_indicators)
+        return _NO_ANSWER_RE.search(response_text) is not None
     
-    def _calculate_confidence(self, response_text: str, citations: List[Dict], num_sources: int) -> float:
+    def _calculate_confidence(self, response_text: str, citations: List[Citation], num_sources: int) -> float:
         """Calculate confidence score for the response."""
-        confidence = 0.3  # Base confidence
-        
-        # Increase confidence based on citations
-        if citations:
-            confidence += min(0.4, len(citations) * 0.1)  # Up to 0.4 for citations
-        
-        # Increase confidence based on number of source documents
-        if num_sources > 0:
-            confidence += min(0.2, num_sources * 0.05)  # Up to 0.2 for sources
-        
-        # Increase confidence if response is detailed
-        word_count = len(response_text.split())
-        if word_count > 50:
-            confidence += 0.1
-        elif word_count > 20:
-            confidence += 0.05
-        
-        # Decrease confidence if response is too short
-        if word_count < 10:
-            confidence -= 0.2
-        
-        # Decrease confidence if no specific citations
-        if not citations:
-            confidence -= 0.3
+        # Only thresholds up to 50 words matter, so stop splitting after 51 words;
+        # counts stay exact below the cap and long answers never build a full word list
+        word_count = len(response_text.split(None, _WORD_COUNT_CAP))
         
         # Check for specific factual indicators
-        if any(indicator in response_text.lower() for indicator in ['according to', 'states that', 'specifies', 'indicates']):
-            confidence += 0.1
+        has_factual_indicator = _FACTUAL_RE.search(response_text) is not None
         
-        return min(max(confidence, 0.0), 1.0)
+        return _confidence_score(len(citations), num_sources, word_count, has_factual_indicator)
+    
+    def clear_cache(self):
+        """Clear cached responses, e.g. after the index contents change."""
+        self._cache.clear()
     
     def clear_memory(self):
         """Clear conversation memory."""
         try:
             self.memory.reset()
+            self._recent.clear()
             logger.info("Memory cleared successfully")
         except Exception as e:
             logger.error(f"Failed to clear memory: {str(e)}")
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.query_engine import QueryEngine
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class QueryProcessor:
+    """Queue in front of a QueryEngine that dispatches concurrent, stateless questions in batches."""
+
+    def __init__(self,
+                 engine: QueryEngine,
+                 max_batch_size: int = 8,
+                 max_wait: float = 0.1):
+        """
+        Initialize the query processor.
+
+        Args:
+            engine: Query engine that answers the questions
+            max_batch_size: Maximum number of questions dispatched together
+            max_wait: Seconds to wait for more questions before dispatching a partial batch
+        """
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, question: str) -> Dict[str, Any]:
+        """
+        Queue a question and wait for its answer.
+
+        Args:
+            question (str): User's question
+
+        Returns:
+            Dict[str, Any]: Response with answer and citations
+        """
+        self._ensure_worker()
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((question, future))
+        return await future
+
+    async def stop(self):
+        """Stop the background worker once queued questions have been answered."""
+        if self._worker is None:
+            return
+
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+
+        self._worker = None
+        self._queue = None
+        logger.info("Query processor stopped")
+
+    def _ensure_worker(self):
+        """Start the background worker on first use, inside the running event loop."""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+            logger.info("Query processor started")
+
+    async def _run(self):
+        """Drain the queue in batches and answer each batch concurrently."""
+        while True:
+            batch = await self._collect_batch()
+
+            # Questions in a batch run concurrently on one engine, so they are answered
+            # without conversation context; otherwise they would interleave one memory
+            results = await asyncio.gather(
+                *(self.engine.aquery(question, use_context=False) for question, _ in batch),
+                return_exceptions=True
+            )
+
+            for (_, future), result in zip(batch, results):
+                if future.cancelled():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+            for _ in batch:
+                self._queue.task_done()
+
+            logger.info(f"Dispatched batch of {len(batch)} questions")
+
+    async def _collect_batch(self) -> List[Tuple[str, asyncio.Future]]:
+        """Wait for one question, then gather more until the batch is full or max_wait elapses."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
@@ -1,4 +1,5 @@
 from dotenv import load_dotenv
+from functools import lru_cache
 import os
 from typing import Optional
 
@@ -27,23 +28,34 @@ DEFAULT_CHUNK_SIZE = int(os.getenv("DEFAULT_CHUNK_SIZE", "512"))
 DEFAULT_CHUNK_OVERLAP = int(os.getenv("DEFAULT_CHUNK_OVERLAP", "50"))
 DEFAULT_MEMORY_LIMIT = int(os.getenv("DEFAULT_MEMORY_LIMIT", "3000"))
 
+# Embedding Configuration ("openai", or "huggingface" for a local model)
+EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "openai").lower()
+EMBED_MODEL = os.getenv("EMBED_MODEL")  # Defaults to a model per provider
+EMBED_DEVICE = os.getenv("EMBED_DEVICE")  # e.g. "cuda" or "cpu" for local models
+
+# PDF Parsing Configuration ("llamaparse" or "pymupdf")
+PDF_PARSER = os.getenv("PDF_PARSER", "llamaparse").lower()
+
 # File Upload Configuration
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "50"))  # MB
 ALLOWED_EXTENSIONS = os.getenv("ALLOWED_EXTENSIONS", "pdf,txt,docx,md").split(",")
 
+# Settings that must have a value, checked against the resolved values above so defaults count
+_REQUIRED = (
+    "GEMINI_API_KEY",
+    "OPENAI_API_KEY",
+    "LLAMAPARSE_API_KEY",
+    "NEO4J_URI",
+    "NEO4J_USER",
+    "NEO4J_PASSWORD",
+)
+
 # Validation functions
+@lru_cache(maxsize=1)
 def validate_required_env_vars() -> bool:
-    """Validate that all required environment variables are set."""
-    required_vars = {
-        "GEMINI_API_KEY": GEMINI_API_KEY,
-        "OPENAI_API_KEY": OPENAI_API_KEY,
-        "LLAMAPARSE_API_KEY": LLAMAPARSE_API_KEY,
-        "NEO4J_URI": NEO4J_URI,
-        "NEO4J_USER": NEO4J_USER,
-        "NEO4J_PASSWORD": NEO4J_PASSWORD,
-    }
-    
-    missing_vars = [var for var, value in required_vars.items() if not value]
+    """Validate that all required environment variables are set. The result is computed once per process."""
+    settings = globals()
+    missing_vars = [name for name in _REQUIRED if not settings[name]]
     
     if missing_vars:
         print(f"❌ Missing required environment variables: {', '.join(missing_vars)}")
@@ -53,10 +65,12 @@ def validate_required_env_vars() -> bool:
     return True
 
 
-SYSTEM_PROMPT = """You are a highly intelligent multilingual assistant that provides comprehensive, detailed answers based strictly on the provided sources.
+# System prompts by question language; the engine detects the language in code so each
+# prompt only carries the instructions for one language
+SYSTEM_PROMPT_EN = """You are a highly intelligent assistant that provides comprehensive, detailed answers based strictly on the provided sources.
 
 CRITICAL INSTRUCTIONS:
-1. **Language Matching**: You MUST respond in the EXACT same language as the user's question. If the user asks in Arabic, respond ENTIRELY in Arabic. If in English, respond in English.
+1. **Language**: Respond in English.
 
 2. **Comprehensive Answers**: Provide detailed, thorough responses. Extract ALL relevant information from the sources. Include:
    - Complete explanations with full details
@@ -67,11 +81,24 @@ CRITICAL INSTRUCTIONS:
 
 3. **Source Citation**: Every piece of information MUST be followed by its source citation in square brackets like [1], [2], etc.
 
-4. **Arabic Language**: When responding in Arabic, use proper formal Arabic and maintain technical terminology from the source documents.
+4. **Accuracy**: If information is not found in the provided sources, state clearly: "The provided documents do not contain an answer to this question"
+"""
+
+SYSTEM_PROMPT_AR = """You are a highly intelligent assistant that provides comprehensive, detailed answers based strictly on the provided sources.
+
+CRITICAL INSTRUCTIONS:
+1. **Language**: Respond ENTIRELY in formal Arabic and keep the technical terminology from the source documents.
+
+2. **Comprehensive Answers**: Provide detailed, thorough responses. Extract ALL relevant information from the sources, including complete explanations, facts, examples, lists and steps. Do NOT summarize unless explicitly asked.
+
+3. **Source Citation**: Every piece of information MUST be followed by its source citation in square brackets like [1], [2], etc.
 
-5. **Accuracy**: If information is not found in the provided sources, state clearly:
-   - Arabic: "المستندات المقدمة لا تحتوي على إجابة لهذا السؤال"
-   - English: "The provided documents do not contain an answer to this question"
+4. **Accuracy**: If information is not found in the provided sources, state clearly: "المستندات المقدمة لا تحتوي على إجابة لهذا السؤال"
+"""
 
-Your primary goal is to be comprehensive, accurate, and maintain the user's language choice.
-"""
\ No newline at end of file
+# Compact fallback for questions whose language can't be told from the script alone
+SYSTEM_PROMPT = """You are a multilingual assistant that answers comprehensively and strictly from the provided sources.
+- Respond in the same language as the user's question.
+- Follow every piece of information with its source citation in square brackets like [1], [2], etc.
+- If the sources don't contain the answer, say so clearly in the user's language.
+"""
@@ -4,16 +4,18 @@ import os
 import sys
 import tempfile
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.document_parser import parse_pdf, validate_pdf
-from app.index_builder import IndexBuilder
-from app.query_engine import QueryEngine
+from app.document_parser import parse_pdfs_batch, validate_pdf, HASH_DIGEST_SIZE
+from app.index_builder import IndexBuilder, INSERT_BATCH_SIZE, get_cache_similarity_threshold
+from app.query_engine import QueryEngine, SourceDocument
+from app.query_cache import QueryCache
 from llama_index.core import VectorStoreIndex
 import logging
-from typing import List, Dict, Any
-import hashlib
+from typing import List, Dict, Any, Tuple
+from blake3 import blake3
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,95 +30,39 @@ st.set_page_config(
 )
 
 # Custom CSS to match the dark theme from the image ---
-st.markdown("""
-<style>
-    /* Set the base background color for the main app area */
-    .stApp {
-        background-color: #0F172A; /* Dark Slate Blue */
-    }
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        color: #FFFFFF; /* White text */
-        text-align: center;
-        margin-bottom: 2rem;
-    }
-    .upload-section {
-        background-color: #1E293B; /* Darker Slate */
-        padding: 2rem;
-        border-radius: 1rem;
-        margin: 1rem 0;
-        border: 1px solid #334155;
-    }
-    /* User's question bubble - Light Blue */
-    .chat-question {
-        background-color: #E0F2FE; /* Light Cyan */
-        color: #0c4a6e; /* Dark Cyan text for readability */
-        padding: 1rem;
-        border-radius: 0.75rem; /* More rounded corners */
-        margin: 0.5rem 0;
-        border-left: 5px solid #3B82F6; /* Brighter Blue border */
-    }
-    /* Assistant's answer bubble - Light Lavender */
-    .chat-answer {
-        background-color: #F3E8FF; /* Light Lavender */
-        color: #581c87; /* Dark Purple text for readability */
-        padding: 1rem;
-        border-radius: 0.75rem; /* More rounded corners */
-        margin: 0.5rem 0;
-        border-left: 5px solid #9333EA; /* Brighter Purple border */
-    }
-    /* Source document snippets - Dark themed */
-    .source-document {
-        background-color: #1F2937; /* Dark Gray */
-        padding: 0.8rem;
-        border-radius: 0.5rem;
-        margin: 0.3rem 0;
-        border-left: 3px solid #0D9488; /* Teal border */
-        font-size: 0.9rem;
-    }
-    /* Confidence scores */
-    .confidence-high { color: #22C55E; font-weight: bold; } /* Bright Green from image */
-    .confidence-medium { color: #F59E0B; font-weight: bold; } /* Amber */
-    .confidence-low { color: #EF4444; font-weight: bold; } /* Red */
-
-    /* General text color for dark theme */
-    div, p, span, li {
-        color: #E2E8F0; /* Light Slate Gray for text */
-    }
-    /* Headers and titles */
-    h1, h2, h3 {
-        color: #FFFFFF;
-    }
-    /* Sidebar styling */
-    .st-emotion-cache-16txtl3 {
-        background-color: #1E293B; /* Dark Slate for sidebar */
-    }
-    /* Ensure chat text inside bubbles has the correct color */
-    .chat-question p, .chat-question li {
-        color: #0c4a6e;
-    }
-    .chat-answer p, .chat-answer li {
-        color: #581c87;
-    }
-    /* Change button style to be more visible on dark theme */
-    .stButton>button {
-        border-color: #334155;
-        background-color: #334155;
-        color: #FFFFFF;
-    }
-    .stButton>button:hover {
-        border-color: #475569;
-        background-color: #475569;
-        color: #FFFFFF;
-    }
-</style>
-""", unsafe_allow_html=True)
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "app.css")
+
+@st.cache_resource(show_spinner=False)
+def _css() -> str:
+    """Read the stylesheet once per process; it is still injected on every rerun."""
+    with open(CSS_PATH, encoding="utf-8") as f:
+        return f.read()
+
+st.markdown(f"<style>{_css()}</style>", unsafe_allow_html=True)
+
+
+# Uploads are hashed and written in slices of this many bytes
+UPLOAD_CHUNK_SIZE = 1 << 20
 
+# Chat turns rendered on every rerun; older turns are rendered only on request
+CHAT_HISTORY_WINDOW = 10
 
-def get_file_hash(file_content: bytes) -> str:
-    """Generate a hash for file content to detect duplicates."""
-    return hashlib.md5(file_content).hexdigest()
+
+def save_uploaded_file(uploaded_file: Any, path: str) -> Tuple[str, int]:
+    """
+    Write an upload to disk while hashing it, one zero-copy slice of its buffer at a time.
+    
+    Returns:
+        Tuple of (content hash, size in bytes); the hash matches app.document_parser.get_file_hash
+    """
+    hasher = blake3()
+    with uploaded_file.getbuffer() as view, open(path, "wb") as f:
+        for start in range(0, view.nbytes, UPLOAD_CHUNK_SIZE):
+            with view[start:start + UPLOAD_CHUNK_SIZE] as chunk:
+                hasher.update(chunk)
+                f.write(chunk)
+        size = view.nbytes
+    return hasher.hexdigest(length=HASH_DIGEST_SIZE), size
 
 def process_uploaded_files(uploaded_files: List[Any]) -> Dict[str, Any]:
     """Process multiple uploaded files, avoiding duplicates already in the DB."""
@@ -124,68 +70,172 @@ def process_uploaded_files(uploaded_files: List[Any]) -> Dict[str, Any]:
         'documents': [], 'errors': [],
         'stats': {'total_files': len(uploaded_files), 'successful_files': 0, 'failed_files': 0, 'total_pages': 0, 'total_size': 0}
     }
-    existing_files_in_db = st.session_state.get("indexed_files", [])
+    existing_files_in_db = st.session_state.get("indexed_files", {})
+    # Names and hashes seen so far, growing as uploads are accepted so repeats within one upload are skipped too
+    seen_names = set(existing_files_in_db)
+    seen_hashes = {file_hash for file_hash in existing_files_in_db.values() if file_hash}
     
     with tempfile.TemporaryDirectory() as temp_dir:
+        # Save, hash and validate each upload first; only files that pass are parsed
+        pending = []
         for uploaded_file in uploaded_files:
-            if uploaded_file.name in existing_files_in_db:
-                results['errors'].append({'file_name': uploaded_file.name, 'error': 'File already exists in the database. Skipped.'})
+            if uploaded_file.name in seen_names:
+                results['errors'].append({'file_name': uploaded_file.name, 'error': 'File already exists in the database or this upload. Skipped.'})
                 results['stats']['failed_files'] += 1
                 continue
             try:
-                file_content = uploaded_file.getbuffer()
                 temp_path = os.path.join(temp_dir, uploaded_file.name)
-                with open(temp_path, "wb") as f: f.write(file_content)
-                if not validate_pdf(temp_path):
+                file_hash, file_size = save_uploaded_file(uploaded_file, temp_path)
+                if file_hash in seen_hashes:
+                    results['errors'].append({'file_name': uploaded_file.name, 'error': 'File with the same content already exists in the database or this upload. Skipped.'})
+                    results['stats']['failed_files'] += 1
+                    continue
+                if not validate_pdf(temp_path, size=file_size):
                     results['errors'].append({'file_name': uploaded_file.name, 'error': 'Invalid PDF file'})
                     results['stats']['failed_files'] += 1
                     continue
-                docs = parse_pdf(temp_path)
-                file_size = len(file_content)
-                for doc in docs:
-                    doc.metadata.update({'file_name': uploaded_file.name, 'file_size': file_size, 'upload_timestamp': datetime.datetime.now().isoformat()})
-                results['documents'].extend(docs)
-                results['stats']['successful_files'] += 1
-                results['stats']['total_pages'] += len(docs)
-                results['stats']['total_size'] += file_size
-                logger.info(f"Successfully parsed {uploaded_file.name} for indexing.")
+                seen_names.add(uploaded_file.name)
+                seen_hashes.add(file_hash)
+                pending.append((uploaded_file.name, temp_path, file_hash, file_size))
             except Exception as e:
                 error_msg = f"Error processing {uploaded_file.name}: {str(e)}"
                 results['errors'].append({'file_name': uploaded_file.name, 'error': str(e)})
                 results['stats']['failed_files'] += 1
                 logger.error(error_msg)
+        
+        # One batch runs every LlamaParse job concurrently on a single client and event loop
+        batch = parse_pdfs_batch(
+            [temp_path for _, temp_path, _, _ in pending],
+            file_hashes={temp_path: file_hash for _, temp_path, file_hash, _ in pending},
+            file_sizes={temp_path: file_size for _, temp_path, _, file_size in pending}
+        )
+        batch_errors = {error['file_path']: error['error'] for error in batch['errors']}
+        
+        # The parser already stamps file_name and file_size; the upload time is shared by the whole batch
+        upload_metadata = {'upload_timestamp': datetime.datetime.now().isoformat()}
+        for file_name, temp_path, _, file_size in pending:
+            docs = batch['documents'].get(temp_path)
+            if docs is None:
+                error = batch_errors.get(temp_path, 'Failed to parse PDF')
+                results['errors'].append({'file_name': file_name, 'error': error})
+                results['stats']['failed_files'] += 1
+                logger.error(f"Error processing {file_name}: {error}")
+                continue
+            for doc in docs:
+                doc.metadata.update(upload_metadata)
+            results['documents'].extend(docs)
+            results['stats']['successful_files'] += 1
+            results['stats']['total_pages'] += len(docs)
+            results['stats']['total_size'] += file_size
+            logger.info(f"Successfully parsed {file_name} for indexing.")
     return results
 
-def display_source_documents(source_docs: List[Dict]):
-    """Display source documents with snippets."""
-    if not source_docs: return
-    st.markdown("<h4>📚 Source Documents:</h4>", unsafe_allow_html=True)
-    for i, doc in enumerate(source_docs[:3]):
-        st.markdown(f"""
-        <div class="source-document">
-            <strong>📄 {doc.get('file_name', 'Unknown')} - Page {doc.get('page', 1)}</strong> (Relevance: {doc.get('relevance_score', 0.0):.2f})<br>
-            <em>"{doc.get('text_snippet', '')}"</em>
-        </div>
-        """, unsafe_allow_html=True)
-
-def on_submit_query():
-    """Callback function to process user query."""
+def source_documents_html(source_docs: List[SourceDocument]) -> str:
+    """Render the top source documents with snippets; built once when a turn is added, not on every rerun."""
+    return "".join(
+        '<div class="source-document">'
+        f'<strong>📄 {doc.file_name} - Page {doc.page}</strong> (Relevance: {doc.relevance_score:.2f})<br>'
+        f'<em>"{doc.text_snippet}"</em>'
+        '</div>'
+        for doc in source_docs[:3]
+    )
+
+def display_source_documents(sources_html: str):
+    """Display pre-rendered source documents in a single markdown element."""
+    if not sources_html: return
+    st.markdown(f"<h4>📚 Source Documents:</h4>{sources_html}", unsafe_allow_html=True)
+
+def confidence_html(confidence: float) -> str:
+    """Render the confidence line; built once when a turn is added, not on every rerun."""
+    conf_class = "high" if confidence > 0.7 else "medium" if confidence > 0.4 else "low"
+    return f"<p class='confidence-{conf_class}'>Confidence: {confidence:.2f}</p>"
+
+def display_chat_turn(chat: Dict[str, Any]):
+    """Display one question/answer turn with its confidence and sources."""
+    # --- MODIFIED: Use new icons and styling ---
+    st.markdown(f'<div class="chat-question"><strong>🧐 You:</strong> {chat["question"]}</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="chat-answer"><strong>🤖 Assistant:</strong><br>{chat["answer"]}</div>', unsafe_allow_html=True)
+    
+    # Confidence and Citations
+    st.markdown(chat['confidence_html'], unsafe_allow_html=True)
+    
+    if chat.get('source_documents'):
+        with st.expander(f"📚 View Source Documents ({len(chat['source_documents'])} found)"):
+            display_source_documents(chat['sources_html'])
+    st.markdown("<hr style='border-top: 1px solid #334155;'>", unsafe_allow_html=True)
+
+def on_submit_query(similarity_top_k: int, response_mode: str):
+    """Callback function to process user query with the current retrieval settings."""
     user_query = st.session_state.user_input
     if user_query and st.session_state.get("chat_engine"):
         with st.spinner("🤔 Analyzing documents..."):
-            response = st.session_state["chat_engine"].query(user_query)
-            st.session_state["chat_history"].append({**response, "question": user_query})
+            # Let a running warm-up finish first; its errors resurface from query() itself
+            warm_up = st.session_state.get("_warm_up")
+            if warm_up is not None:
+                warm_up.exception()
+            response = st.session_state["chat_engine"].query(user_query, top_k=similarity_top_k, response_mode=response_mode)
+            st.session_state["chat_history"].append({
+                **response,
+                "question": user_query,
+                "confidence_html": confidence_html(response["confidence"]),
+                "sources_html": source_documents_html(response["source_documents"])
+            })
+
+@st.cache_resource(show_spinner=False)
+def _get_index_builder() -> IndexBuilder:
+    """Index builder (and its Neo4j drivers) shared across reruns and sessions for the app's lifetime."""
+    return IndexBuilder()
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _list_indexed_documents() -> Dict[str, Any]:
+    """Indexed document names mapped to content hashes, memoized so reruns don't re-list Neo4j."""
+    return _get_index_builder().get_existing_document_hashes()
+
+@st.cache_resource
+def _get_executor() -> ThreadPoolExecutor:
+    """Background worker pool shared across reruns and sessions."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-background")
 
-def initialize_chat_engine(memory_limit, similarity_top_k):
+@st.cache_resource
+def get_query_cache() -> QueryCache:
+    """Response cache shared by every session, since they all query the same index."""
+    return QueryCache(max_size=500, similarity_threshold=get_cache_similarity_threshold(), ttl=600)
+
+@st.fragment(run_every=1)
+def clear_database_status():
+    """Poll the background database deletion and reset the app once it finishes."""
+    future = st.session_state.get("_clear_fut")
+    if future is None:
+        return
+    if not future.done():
+        st.info("🗑️ Deleting all documents from database...")
+        return
+    
+    try:
+        future.result()
+    except Exception as e:
+        del st.session_state["_clear_fut"]
+        st.session_state["_clear_error"] = str(e)
+        st.rerun()
+    
+    # The shared builder recreated the empty vector index, so it stays open for other sessions
+    get_query_cache().clear()
+    _list_indexed_documents.clear()
+    st.session_state.clear()
+    st.rerun()
+
+def initialize_chat_engine(memory_limit, similarity_top_k, response_mode):
     """Initializes the chat engine and stores it in session state."""
     if "chat_engine" in st.session_state and st.session_state["chat_engine"]:
         return # Already initialized
     try:
         with st.spinner("🚀 Initializing chat engine..."):
-            index_builder = IndexBuilder()
+            index_builder = _get_index_builder()
             index = VectorStoreIndex.from_vector_store(index_builder.vector_store)
-            chat_engine = QueryEngine(index=index, memory_token_limit=memory_limit, similarity_top_k=similarity_top_k)
+            chat_engine = QueryEngine(index=index, memory_token_limit=memory_limit, similarity_top_k=similarity_top_k, cache=get_query_cache())
             st.session_state["chat_engine"] = chat_engine
+            # Client setup runs in the background while the user reads the page
+            st.session_state["_warm_up"] = _get_executor().submit(chat_engine.warm_up, similarity_top_k, response_mode)
             logger.info("Chat engine initialized successfully.")
     except Exception as e:
         st.error(f"❌ Failed to initialize chat engine: {e}")
@@ -199,14 +249,35 @@ def main():
         st.session_state["db_checked"] = False
         st.session_state["chat_engine"] = None
         st.session_state["chat_history"] = []
-        st.session_state["indexed_files"] = []
+        st.session_state["indexed_files"] = {}
 
+    # --- Initial DB Check ---
+    # Runs before the sidebar so the first pass already renders the knowledge base
+    if not st.session_state["db_checked"]:
+        with st.spinner("Connecting to database..."):
+            try:
+                existing_files = _list_indexed_documents()
+                st.session_state["indexed_files"] = existing_files
+                st.session_state["db_checked"] = True 
+                if existing_files:
+                    st.toast(f"Found {len(existing_files)} documents in the database.", icon="📚")
+                else:
+                    st.toast("No existing documents found.", icon="📄")
+            except Exception as e:
+                st.error(f"❌ Could not connect to Neo4j. Check settings. Error: {e}")
+                st.session_state["db_checked"] = True 
+    
     # --- Sidebar ---
     with st.sidebar:
         st.header("⚙️ Configuration")
         chunk_size = st.slider("Chunk Size", 256, 1024, 512, 128, help="Size of text chunks for new documents")
         memory_limit = st.slider("Memory Token Limit", 1000, 5000, 3000, 500, help="Max tokens in conversation memory")
-        similarity_top_k = st.slider("Similarity Search Results", 1, 30, 15, 1, help="Number of similar chunks to retrieve")
+        similarity_top_k = st.slider("Similarity Search Results", 1, 30, 5, 1, help="Number of similar chunks to retrieve")
+        response_mode = st.selectbox(
+            "Response Mode", ["compact", "tree_summarize", "refine"], index=0,
+            help="compact packs the retrieved chunks into as few LLM calls as possible (usually one); "
+                 "tree_summarize summarizes them hierarchically; refine makes one LLM call per chunk"
+        )
 
         st.header("🔄 Actions")
         if st.button("🗑️ Clear Chat Memory"):
@@ -216,16 +287,13 @@ def main():
             st.success("Chat memory cleared!")
             st.rerun()
 
-        if st.button("⚠️ Clear Database & Reset", type="primary"):
-            with st.spinner("Deleting all documents from database..."):
-                try:
-                    builder = IndexBuilder()
-                    builder.delete_all_documents()
-                    for key in list(st.session_state.keys()): del st.session_state[key]
-                    st.success("Database cleared. Refreshing...")
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"Failed to clear database: {e}")
+        if st.button("⚠️ Clear Database & Reset", type="primary", disabled="_clear_fut" in st.session_state):
+            # Deletion runs in the background; clear_database_status polls it without blocking the UI
+            st.session_state["_clear_fut"] = _get_executor().submit(_get_index_builder().delete_all_documents)
+        if "_clear_fut" in st.session_state:
+            clear_database_status()
+        if "_clear_error" in st.session_state:
+            st.error(f"Failed to clear database: {st.session_state.pop('_clear_error')}")
 
         # --- Document & Memory Stats ---
         if st.session_state.get("indexed_files"):
@@ -240,26 +308,9 @@ def main():
             if "error" not in memory_stats:
                 st.metric("Memory Messages", memory_stats.get('messages_count', 0))
 
-    # --- Initial DB Check ---
-    if not st.session_state["db_checked"]:
-        with st.spinner("Connecting to database..."):
-            try:
-                builder = IndexBuilder()
-                existing_files = builder.get_existing_document_names()
-                st.session_state["indexed_files"] = existing_files
-                st.session_state["db_checked"] = True 
-                if existing_files:
-                    st.toast(f"Found {len(existing_files)} documents in the database.", icon="📚")
-                    st.rerun() 
-                else:
-                    st.toast("No existing documents found.", icon="📄")
-            except Exception as e:
-                st.error(f"❌ Could not connect to Neo4j. Check settings. Error: {e}")
-                st.session_state["db_checked"] = True 
-    
     # --- Chat Engine Initialization Logic ---
     if st.session_state.get("indexed_files") and not st.session_state.get("chat_engine"):
-        initialize_chat_engine(memory_limit, similarity_top_k)
+        initialize_chat_engine(memory_limit, similarity_top_k, response_mode)
 
     # --- File Upload & Processing Section ---
     upload_label = "Add More Documents" if st.session_state.get("chat_engine") else "Upload Documents to Begin"
@@ -274,8 +325,14 @@ def main():
                 if results['documents']:
                     with st.spinner("Adding new documents to the search index..."):
                         try:
-                            builder = IndexBuilder(chunk_size=chunk_size)
-                            builder.build_index(results['documents'])
+                            # Smaller insert batches for big uploads keep each Neo4j write bounded
+                            batch_size = min(INSERT_BATCH_SIZE, max(64, len(results['documents']) // (os.cpu_count() or 4)))
+                            # Sync embedding: the process-wide embedder's async client would otherwise be
+                            # shared across the event loops of different sessions
+                            _get_index_builder().build_index(results['documents'], batch_size=batch_size, chunk_size=chunk_size)
+                            # Cached answers may be missing the new documents
+                            get_query_cache().clear()
+                            _list_indexed_documents.clear()
                             st.success(f"✅ Added {results['stats']['successful_files']} new document(s)!")
                             st.session_state['db_checked'] = False 
                             st.rerun()
@@ -287,25 +344,24 @@ def main():
     # --- Chat Interface ---
     if st.session_state.get("chat_engine"):
         st.header("💬 Chat with your Documents")
-        st.text_input("Ask a question:", key="user_input", on_change=on_submit_query, placeholder="e.g., What are the registration requirements?")
+        warm_up = st.session_state.get("_warm_up")
+        if warm_up is not None and not warm_up.done():
+            st.caption("⏳ Warming up the chat engine...")
+        elif warm_up is not None and warm_up.exception():
+            st.error(f"❌ Failed to initialize chat engine: {warm_up.exception()}")
+        st.text_input("Ask a question:", key="user_input", on_change=on_submit_query, args=(similarity_top_k, response_mode), placeholder="e.g., What are the registration requirements?")
         
-        # Display chat history
-        if st.session_state["chat_history"]:
+        # Display chat history, newest first; only the latest turns are rendered by default
+        history = st.session_state["chat_history"]
+        if history:
             st.subheader("📝 Conversation History")
-            for i, chat in enumerate(reversed(st.session_state["chat_history"])):
-                # --- MODIFIED: Use new icons and styling ---
-                st.markdown(f'<div class="chat-question"><strong>🧐 You:</strong> {chat["question"]}</div>', unsafe_allow_html=True)
-                st.markdown(f'<div class="chat-answer"><strong>🤖 Assistant:</strong><br>{chat["answer"]}</div>', unsafe_allow_html=True)
-                
-                # Confidence and Citations
-                confidence = chat['confidence']
-                conf_class = "high" if confidence > 0.7 else "medium" if confidence > 0.4 else "low"
-                st.markdown(f"<p class='confidence-{conf_class}'>Confidence: {confidence:.2f}</p>", unsafe_allow_html=True)
-                
-                if chat.get('source_documents'):
-                    with st.expander(f"📚 View Source Documents ({len(chat['source_documents'])} found)"):
-                        display_source_documents(chat['source_documents'])
-                st.markdown("<hr style='border-top: 1px solid #334155;'>", unsafe_allow_html=True)
+            for chat in reversed(history[-CHAT_HISTORY_WINDOW:]):
+                display_chat_turn(chat)
+            
+            older = history[:-CHAT_HISTORY_WINDOW]
+            if older and st.toggle(f"Show {len(older)} older message(s)", key="show_older_messages"):
+                for chat in reversed(older):
+                    display_chat_turn(chat)
     else:
         st.info("📄 Please upload PDF documents to build a knowledge base and start chatting.")
 
@@ -0,0 +1,112 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from app.query_cache import QueryCache
+
+
+def _unit(*values):
+    """Normalized float32 embedding, as QueryEngine passes to the cache."""
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class _Clock:
+    """Stand-in for time.monotonic that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = _Clock()
+        patcher = mock.patch("app.query_cache.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_put_stores_exact_and_similar_entries(self):
+        cache = QueryCache(max_size=4)
+        response = {"answer": "a"}
+        cache.put("key", "ns", _unit(1, 0, 0), response)
+
+        self.assertIs(cache.get_exact("key"), response)
+        self.assertIs(cache.get_similar("ns", _unit(1, 0, 0)), response)
+
+    def test_similar_lookup_respects_threshold(self):
+        cache = QueryCache(max_size=4, similarity_threshold=0.97)
+        cache.put("key", "ns", _unit(1, 0, 0), {"answer": "a"})
+
+        self.assertIsNotNone(cache.get_similar("ns", _unit(1, 0.1, 0)))  # cosine ~0.995
+        self.assertIsNone(cache.get_similar("ns", _unit(1, 0.5, 0)))  # cosine ~0.894
+
+    def test_similar_eviction_drops_least_recently_used(self):
+        cache = QueryCache(max_size=2)
+        cache.put("a", "ns", _unit(1, 0, 0), {"answer": "a"})
+        cache.put("b", "ns", _unit(0, 1, 0), {"answer": "b"})
+
+        # Touch "a" so "b" becomes the least recently used entry
+        self.assertEqual(cache.get_similar("ns", _unit(1, 0, 0))["answer"], "a")
+        cache.put("c", "ns", _unit(0, 0, 1), {"answer": "c"})
+
+        self.assertEqual(cache.get_similar("ns", _unit(1, 0, 0))["answer"], "a")
+        self.assertIsNone(cache.get_similar("ns", _unit(0, 1, 0)))
+        self.assertEqual(cache.get_similar("ns", _unit(0, 0, 1))["answer"], "c")
+
+    def test_exact_eviction_drops_least_recently_used(self):
+        cache = QueryCache(exact_max_size=2)
+        cache.put_exact("a", {"answer": "a"})
+        cache.put_exact("b", {"answer": "b"})
+
+        self.assertIsNotNone(cache.get_exact("a"))
+        cache.put_exact("c", {"answer": "c"})
+
+        self.assertIsNotNone(cache.get_exact("a"))
+        self.assertIsNone(cache.get_exact("b"))
+        self.assertIsNotNone(cache.get_exact("c"))
+
+    def test_entries_expire_after_ttl(self):
+        cache = QueryCache(max_size=4, ttl=10.0)
+        cache.put("old", "ns", _unit(1, 0, 0), {"answer": "old"})
+        self.clock.now += 5
+        cache.put("new", "ns", _unit(0, 1, 0), {"answer": "new"})
+        self.clock.now += 6
+
+        self.assertIsNone(cache.get_exact("old"))
+        self.assertIsNone(cache.get_similar("ns", _unit(1, 0, 0)))
+        self.assertEqual(cache.get_exact("new")["answer"], "new")
+        self.assertEqual(cache.get_similar("ns", _unit(0, 1, 0))["answer"], "new")
+
+    def test_expired_entry_never_wins_over_a_fresh_match(self):
+        cache = QueryCache(max_size=4, similarity_threshold=0.9, ttl=10.0)
+        cache.put("old", "ns", _unit(1, 0, 0), {"answer": "old"})
+        self.clock.now += 5
+        cache.put("new", "ns", _unit(1, 0.3, 0), {"answer": "new"})
+        self.clock.now += 6
+
+        # The expired entry matches the query exactly but must be masked out
+        self.assertEqual(cache.get_similar("ns", _unit(1, 0, 0))["answer"], "new")
+
+    def test_namespaces_are_isolated(self):
+        cache = QueryCache(max_size=4)
+        cache.put("key", (5, "compact", "en"), _unit(1, 0, 0), {"answer": "a"})
+
+        self.assertIsNone(cache.get_similar((5, "refine", "en"), _unit(1, 0, 0)))
+        self.assertIsNotNone(cache.get_similar((5, "compact", "en"), _unit(1, 0, 0)))
+
+    def test_clear_drops_everything(self):
+        cache = QueryCache(max_size=4)
+        cache.put("key", "ns", _unit(1, 0, 0), {"answer": "a"})
+        cache.clear()
+
+        self.assertIsNone(cache.get_exact("key"))
+        self.assertIsNone(cache.get_similar("ns", _unit(1, 0, 0)))
+
+
+if __name__ == "__main__":
+    unittest.main()
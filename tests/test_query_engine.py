@@ -0,0 +1,39 @@
+import unittest
+
+from app.query_engine import QueryEngine
+
+
+class CitationExtractionTest(unittest.TestCase):
+
+    def setUp(self):
+        # Components are created lazily, so no index or API keys are needed to extract citations
+        self.engine = QueryEngine(index=None)
+
+    def _cites(self, text):
+        return {(c.file, c.page) for c in self.engine._extract_citations_from_text(text)}
+
+    def test_each_citation_form(self):
+        self.assertEqual(
+            self._cites("[Source: a.pdf, Page: 1] and b.pdf - Page 4 (c.pdf, p. 5)"),
+            {("a.pdf", 1), ("b.pdf", 4), ("c.pdf", 5)}
+        )
+
+    def test_dash_citation_inside_parenthesised_citation_is_found(self):
+        # The parenthesised form spans the dash form; both must be reported, as with separate scans
+        self.assertEqual(
+            self._cites("(see x.pdf - Page 2 and y.pdf, p. 3)"),
+            {("x.pdf", 2), ("see x.pdf - Page 2 and y.pdf", 3)}
+        )
+
+    def test_dash_citation_inside_source_citation_is_found(self):
+        self.assertEqual(
+            self._cites("[Source: x.pdf - Page 2 and y.pdf, Page: 3]"),
+            {("x.pdf", 2), ("x.pdf - Page 2 and y.pdf", 3)}
+        )
+
+    def test_no_citations(self):
+        self.assertEqual(self._cites("No sources were referenced."), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import asyncio
+import unittest
+
+from llama_index.core import Settings
+from llama_index.core.embeddings import MockEmbedding
+
+from app.query_engine import QueryEngine
+from app.query_processor import QueryProcessor
+
+
+class _Response:
+    """Minimal stand-in for a citation engine response."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.source_nodes = []
+
+    def __str__(self):
+        return self.text
+
+
+class _CitationEngine:
+    """Answers by echoing the query, yielding to the event loop like a real LLM call."""
+
+    def __init__(self):
+        self.queries = []
+
+    async def aquery(self, query_bundle):
+        self.queries.append(query_bundle.query_str)
+        await asyncio.sleep(0.01)
+        return _Response(f"Answer to: {query_bundle.query_str}")
+
+
+class _TestQueryEngine(QueryEngine):
+    """QueryEngine with the LLM and citation engine replaced, so no API keys are needed."""
+
+    def __init__(self):
+        super().__init__(index=None)
+        self.fake_engine = _CitationEngine()
+
+    def _create_llm(self, language: str):
+        return None
+
+    def _create_citation_engine(self, similarity_top_k: int, response_mode: str, language: str):
+        return self.fake_engine
+
+
+class QueryProcessorTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        Settings.embed_model = MockEmbedding(embed_dim=8)
+        self.engine = _TestQueryEngine()
+        self.processor = QueryProcessor(self.engine, max_wait=0.05)
+
+    async def asyncTearDown(self):
+        await self.processor.stop()
+
+    async def test_concurrent_questions_do_not_share_conversation(self):
+        first, second = await asyncio.gather(
+            self.processor.submit("What does the first contract say about termination?"),
+            self.processor.submit("What does the second contract say about payment terms?"),
+        )
+
+        self.assertEqual(first["answer"], "Answer to: What does the first contract say about termination?")
+        self.assertEqual(second["answer"], "Answer to: What does the second contract say about payment terms?")
+
+        # Neither question saw the other's exchange, and nothing was written to memory
+        self.assertEqual(len(self.engine.fake_engine.queries), 2)
+        for query_str in self.engine.fake_engine.queries:
+            self.assertNotIn("Previous conversation context", query_str)
+        self.assertEqual(self.engine.memory.get_all(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()